@@ -0,0 +1,263 @@
+"""Архив старых заявок.
+
+Заявки старше ARCHIVE_AFTER_DAYS дней периодически переносятся порциями
+в сжатые файлы по магазинам и месяцам (ARCHIVE_DIR/tenant<id>/2026-03.jsonl.gz)
+и удаляются из form_responses и индекса поиска. Счётчики статистики
+не трогаются, поэтому отчёты остаются прежними. Каталог архивных месяцев —
+таблица archived_months; месяц можно выгрузить или вернуть в таблицу заявок.
+
+Переносом и возвратом занимается только фоновый архиватор (воркер с
+RUN_BACKGROUND_JOBS): админ из любого воркера лишь ставит запрос на возврат
+в archived_months. Иначе возврат в одном процессе и дописывание того же
+месяца в другом могли бы удалить файл вместе с только что перенесёнными заявками.
+
+Порция сначала дописывается в файл (отдельным gzip-членом), и только потом
+удаляется из БД. Если процесс упадёт между этими шагами, порция попадёт
+в файл второй раз — при чтении архива повторы отбрасываются по id.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, func, or_, select, update
+
+from config import config
+from database import get_db, upsert
+from models import ArchivedMonth, FormResponse
+from search import index_responses, unindex_responses
+
+logger = logging.getLogger(__name__)
+
+MONTH_FORMAT = "%Y-%m"
+_MONTH = re.compile(r"\d{4}-\d{2}")
+RESTORE_CHUNK = 1000
+# Как часто архиватор проверяет запросы на возврат из других воркеров
+RESTORE_POLL_SECONDS = 10
+
+
+def month_path(tenant_id: int, month: str, directory: Optional[str] = None) -> str:
+    if not _MONTH.fullmatch(month):
+        raise ValueError(f"Неверный месяц архива: {month}")
+    return os.path.join(directory or config.ARCHIVE_DIR, f"tenant{tenant_id}", f"{month}.jsonl.gz")
+
+
+def _record(row) -> dict:
+    return {
+        "id": row.id,
+        "tenant_id": row.tenant_id,
+        "user_id": row.user_id,
+        "button_id": row.button_id,
+        "answers": row.answers,  # как в БД — строка JSON
+        "created_at": row.created_at,
+        "submitted_at": row.submitted_at.isoformat(),
+    }
+
+
+def _append(path: str, records: List[dict]):
+    """Дописывает записи в архивный файл и дожидается их попадания на диск"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            f.writelines(json.dumps(record, ensure_ascii=False).encode() + b"\n" for record in records)
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def read_month(path: str) -> List[dict]:
+    """Записи архивного файла по возрастанию id, без повторов. Блокирующий вызов"""
+    records: Dict[int, dict] = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            record["submitted_at"] = datetime.fromisoformat(record["submitted_at"])
+            records[record["id"]] = record
+    return [records[record_id] for record_id in sorted(records)]
+
+
+async def list_months(session, tenant_id: int) -> List[ArchivedMonth]:
+    return (await session.scalars(
+        select(ArchivedMonth).where(ArchivedMonth.tenant_id == tenant_id).order_by(ArchivedMonth.month.desc())
+    )).all()
+
+
+class Archiver:
+    """Фоновый перенос старых заявок в архив и возврат месяцев из него.
+    Перенос и возврат не идут одновременно: оба пишут одни и те же файлы.
+    Задача работает и при выключенном архивировании — чтобы возвращать месяцы"""
+
+    def __init__(self, after_days: int = 0, batch_size: int = 5000, interval: float = 3600):
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.after_days > 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="archiver")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def wake(self):
+        """Сообщает, что появился запрос на возврат"""
+        self._wakeup.set()
+
+    async def _run(self):
+        archive_at = 0.0
+        while True:
+            try:
+                await self.restore_requested()
+            except Exception as e:
+                logger.error(f"Ошибка возврата заявок из архива: {e}")
+            if self.enabled and time.monotonic() >= archive_at:
+                try:
+                    await self.run_once()
+                except Exception as e:
+                    logger.error(f"Ошибка архивирования заявок: {e}")
+                archive_at = time.monotonic() + self.interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=RESTORE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def run_once(self, now: Optional[datetime] = None) -> int:
+        """Переносит в архив все заявки старше after_days дней; возвращает их число"""
+        cutoff = (now or datetime.now()) - timedelta(days=self.after_days)
+        archived = 0
+        async with self.lock:
+            async with get_db() as session:
+                pinned = set((await session.execute(
+                    select(ArchivedMonth.tenant_id, ArchivedMonth.month)
+                    .where(or_(ArchivedMonth.restored == True, ArchivedMonth.restore_requested == True))
+                )).all())
+                # Самая новая заявка всегда остаётся в таблице: SQLite выдаёт новые id
+                # от максимального, и без неё id архивных заявок пошли бы по второму кругу
+                max_id = await session.scalar(select(func.max(FormResponse.id))) or 0
+            last_id = 0
+            while True:
+                async with get_db() as session:
+                    rows = (await session.execute(
+                        select(FormResponse.id, FormResponse.tenant_id, FormResponse.user_id, FormResponse.button_id,
+                               FormResponse.answers, FormResponse.created_at, FormResponse.submitted_at)
+                        .where(FormResponse.submitted_at < cutoff, FormResponse.id > last_id, FormResponse.id < max_id)
+                        .order_by(FormResponse.id).limit(self.batch_size)
+                    )).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                archived += await self._archive_batch(rows, pinned)
+        if archived:
+            logger.info(f"В архив перенесено заявок: {archived}")
+        return archived
+
+    async def _archive_batch(self, rows, pinned: Set[Tuple[int, str]]) -> int:
+        groups: Dict[Tuple[int, str], list] = {}
+        for row in rows:
+            key = (row.tenant_id, row.submitted_at.strftime(MONTH_FORMAT))
+            if key not in pinned:
+                groups.setdefault(key, []).append(row)
+        if not groups:
+            return 0
+        for (tenant_id, month), group in groups.items():
+            await asyncio.to_thread(_append, month_path(tenant_id, month), [_record(row) for row in group])
+        ids = [row.id for group in groups.values() for row in group]
+        now = datetime.now()
+        async with get_db() as session:
+            await session.execute(delete(FormResponse).where(FormResponse.id.in_(ids)))
+            await unindex_responses(session, ids)
+            stmt = upsert(ArchivedMonth.__table__)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["tenant_id", "month"],
+                set_={"rows": ArchivedMonth.__table__.c.rows + stmt.excluded.rows, "updated_at": stmt.excluded.updated_at},
+            )
+            await session.execute(stmt, [
+                {"tenant_id": tenant_id, "month": month, "rows": len(group), "updated_at": now, "restored": False}
+                for (tenant_id, month), group in groups.items()
+            ])
+        return len(ids)
+
+    async def request_restore(self, tenant_id: int, month: str) -> bool:
+        """Просит фоновый архиватор вернуть месяц; False — месяц уже возвращён или его нет"""
+        async with get_db() as session:
+            result = await session.execute(
+                update(ArchivedMonth)
+                .where(ArchivedMonth.tenant_id == tenant_id, ArchivedMonth.month == month,
+                       ArchivedMonth.restored == False)
+                .values(restore_requested=True)
+            )
+        self.wake()
+        return result.rowcount > 0
+
+    async def restore_requested(self) -> int:
+        """Выполняет запросы на возврат; возвращает число вернувшихся заявок"""
+        async with get_db() as session:
+            requested = (await session.execute(
+                select(ArchivedMonth.tenant_id, ArchivedMonth.month).where(ArchivedMonth.restore_requested == True)
+            )).all()
+        restored = 0
+        for tenant_id, month in requested:
+            restored += await self.restore(tenant_id, month)
+        return restored
+
+    async def restore(self, tenant_id: int, month: str) -> int:
+        """Возвращает месяц из архива в таблицу заявок; файл архива удаляется.
+        Возвращённый месяц архиватор больше не трогает, пока его не отправят обратно.
+        Вызывается только в процессе архиватора — из хендлеров есть request_restore"""
+        path = month_path(tenant_id, month)
+        async with self.lock:
+            records = await asyncio.to_thread(read_month, path) if os.path.exists(path) else []
+            async with get_db() as session:
+                restored = 0
+                for start in range(0, len(records), RESTORE_CHUNK):
+                    chunk = records[start:start + RESTORE_CHUNK]
+                    present = set((await session.scalars(
+                        select(FormResponse.id).where(FormResponse.id.in_([record["id"] for record in chunk]))
+                    )).all())
+                    rows = [FormResponse(**record) for record in chunk if record["id"] not in present]
+                    if rows:
+                        session.add_all(rows)
+                        await session.flush()
+                        await index_responses(session, rows)
+                        restored += len(rows)
+                await session.execute(
+                    update(ArchivedMonth)
+                    .where(ArchivedMonth.tenant_id == tenant_id, ArchivedMonth.month == month)
+                    .values(rows=0, restored=True, restore_requested=False, updated_at=datetime.now())
+                )
+            # Заявки уже в БД: без файла при следующем переносе месяц начнётся заново
+            if os.path.exists(path):
+                await asyncio.to_thread(os.remove, path)
+        logger.info(f"Из архива магазина {tenant_id} возвращено заявок за {month}: {restored}")
+        return restored
+
+    async def release(self, tenant_id: int, month: str):
+        """Разрешает снова перенести возвращённый месяц в архив"""
+        async with get_db() as session:
+            await session.execute(
+                update(ArchivedMonth)
+                .where(ArchivedMonth.tenant_id == tenant_id, ArchivedMonth.month == month)
+                .values(restored=False)
+            )
+
+
+archiver = Archiver(
+    after_days=config.ARCHIVE_AFTER_DAYS,
+    batch_size=config.ARCHIVE_BATCH_SIZE,
+    interval=config.ARCHIVE_INTERVAL_SECONDS,
+)
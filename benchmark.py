@@ -0,0 +1,258 @@
+"""Нагрузочный прогон бота без Telegram.
+
+Собирает настоящий Dispatcher из bot.py и подаёт ему синтетические апдейты
+через feed_update. Bot API подменён сессией-заглушкой, которая считает вызовы
+и может добавлять задержку. По каждому сценарию печатаются пропускная
+способность, перцентили времени обработки апдейта и число SQL-запросов.
+
+    python benchmark.py --users 2000 --concurrency 200
+    python benchmark.py --save-baseline           # запомнить результат
+    python benchmark.py                           # сравнить с сохранённым
+
+При сравнении код выхода 1 означает регрессию больше --tolerance.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List
+
+SCENARIOS = ("start", "menu", "form")
+BASE_USER_ID = 10_000_000
+ADMIN_ID = 1
+REQUESTS_CHAT_ID = -1000000000001
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def prepare_environment(args):
+    """Настройки подставляются до импорта config, поэтому bot импортируется позже"""
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+    os.environ.setdefault("ADMIN_IDS", str(ADMIN_ID))
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        workdir = tempfile.mkdtemp(prefix="bot-bench-")
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+
+def make_stub_session(latency: float, calls: Counter):
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, Document, Message, User
+
+    message_ids = itertools.count(1)
+
+    class StubSession(BaseSession):
+        """Отвечает на любые методы Bot API правдоподобной заглушкой"""
+
+        async def make_request(self, bot, method, timeout=None):
+            name = type(method).__name__
+            calls[name] += 1
+            if latency:
+                await asyncio.sleep(latency)
+            if name == "GetMe":
+                return User(id=123456, is_bot=True, first_name="bench")
+            if not name.startswith(("Send", "Copy", "Edit")):
+                return True
+            extra = {}
+            if name == "SendDocument":
+                extra["document"] = Document(file_id="BENCHFILE", file_unique_id="bench")
+            return Message(
+                message_id=next(message_ids), date=int(time.time()),
+                chat=Chat(id=getattr(method, "chat_id", 0) or 0, type="private"),
+                text=getattr(method, "text", None), **extra,
+            )
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def close(self):
+            pass
+
+    return StubSession()
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def message(self, user_id: int, text: str):
+        from aiogram.types import Update
+        update_id = next(self._ids)
+        return Update.model_validate({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "bench", "username": f"u{user_id}"},
+                "text": text,
+            },
+        })
+
+
+async def run_scenario(name: str, args, dp, bot, updates: UpdateFactory, calls: Counter, queries: Counter) -> Dict:
+    from catalog import get_catalog
+
+    catalog = get_catalog()
+    form_buttons = [b for b in catalog.buttons.values() if b.response_type == "form" and b.form]
+    plain_buttons = [b.text for b in catalog.buttons.values() if b.response_type in ("text", "link")]
+    rng = random.Random(args.seed)
+    latencies: List[float] = []
+    slots = asyncio.Semaphore(args.concurrency)
+
+    def scripts(user_id: int) -> List[str]:
+        if name == "start":
+            return ["/start"]
+        if name == "menu":
+            return [rng.choice(plain_buttons)]
+        form = rng.choice(form_buttons)
+        return [form.text] + [f"ответ {i} от {user_id}" for i in range(len(form.form.steps))]
+
+    async def simulate(user_id: int):
+        async with slots:
+            # Апдейты одного пользователя идут последовательно, как в жизни
+            for text in scripts(user_id):
+                started = time.perf_counter()
+                await dp.feed_update(bot, updates.message(user_id, text))
+                latencies.append(time.perf_counter() - started)
+
+    calls.clear()
+    queries.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate(BASE_USER_ID + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    total = len(latencies)
+    return {
+        "updates": total,
+        "seconds": round(elapsed, 3),
+        "throughput": round(total / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "queries_per_update": round(queries["sql"] / total, 2) if total else 0.0,
+        "api_calls_per_update": round(sum(calls.values()) / total, 2) if total else 0.0,
+    }
+
+
+async def run(args) -> Dict[str, Dict]:
+    from aiogram import Bot
+    from sqlalchemy import event, update
+
+    import bot as app
+    from database import get_db, on_engine
+    from models import AdminSettings
+
+    calls: Counter = Counter()
+    queries: Counter = Counter()
+
+    def count_sql(*_):
+        queries["sql"] += 1
+
+    on_engine(lambda sync_engine: event.listen(sync_engine, "before_cursor_execute", count_sql))
+
+    await app.init_db()
+    async with get_db() as session:
+        # Уведомления в группу тоже часть нагрузки — включаем их
+        await session.execute(update(AdminSettings).values(requests_chat_id=REQUESTS_CHAT_ID))
+
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=make_stub_session(args.latency_ms / 1000, calls))
+    dp = app.build_dispatcher()
+    await dp.emit_startup(bot=bot)
+    results = {}
+    updates = UpdateFactory()
+    try:
+        for name in args.scenario:
+            results[name] = await run_scenario(name, args, dp, bot, updates, calls, queries)
+    finally:
+        await dp.emit_shutdown(bot=bot)
+    return results
+
+
+def print_report(results: Dict[str, Dict], baseline: Dict[str, Dict]):
+    header = f"{'сценарий':<8} {'апдейтов':>9} {'апд/с':>9} {'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8} {'SQL/апд':>8} {'API/апд':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        print(f"{name:<8} {r['updates']:>9} {r['throughput']:>9} {r['p50_ms']:>8} {r['p95_ms']:>8} "
+              f"{r['p99_ms']:>8} {r['queries_per_update']:>8} {r['api_calls_per_update']:>8}")
+        base = baseline.get(name)
+        if base:
+            print(f"{'  база':<8} {base['updates']:>9} {base['throughput']:>9} {base['p50_ms']:>8} "
+                  f"{base['p95_ms']:>8} {base['p99_ms']:>8} {base['queries_per_update']:>8} "
+                  f"{base['api_calls_per_update']:>8}")
+
+
+def find_regressions(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    problems = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if r["throughput"] < base["throughput"] * (1 - tolerance):
+            problems.append(f"{name}: пропускная способность {r['throughput']} < {base['throughput']}")
+        if r["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            problems.append(f"{name}: p95 {r['p95_ms']} мс > {base['p95_ms']} мс")
+        if r["queries_per_update"] > base["queries_per_update"] * (1 + tolerance):
+            problems.append(f"{name}: SQL на апдейт {r['queries_per_update']} > {base['queries_per_update']}")
+    return problems
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон хендлеров бота")
+    parser.add_argument("--users", type=int, default=1000, help="число симулируемых пользователей")
+    parser.add_argument("--concurrency", type=int, default=100, help="сколько пользователей активны одновременно")
+    parser.add_argument("--latency-ms", type=float, default=0, help="искусственная задержка Bot API")
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database-url", default="", help="по умолчанию — временная SQLite-база")
+    parser.add_argument("--baseline", default="bench_baseline.json", help="файл с базовыми результатами")
+    parser.add_argument("--save-baseline", action="store_true", help="сохранить результаты как базовые")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    prepare_environment(args)
+    logging.basicConfig(level=logging.WARNING)
+
+    results = asyncio.run(run(args))
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nБазовые результаты сохранены в {args.baseline}")
+        return 0
+
+    problems = find_regressions(results, baseline, args.tolerance)
+    if problems:
+        print("\nРегрессии:")
+        for problem in problems:
+            print(f"  {problem}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,23 +2,47 @@ import asyncio
 import json
 import logging
 import os
+import tempfile
+from dataclasses import replace
 from datetime import datetime
 from aiogram import Bot, Dispatcher, Router, F
-from aiogram.types import (
-    Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup,
-    ReplyKeyboardMarkup, KeyboardButton
-)
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.types import Message, CallbackQuery, FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from typing import List, Tuple
+from sqlalchemy import select, func, update
+from sqlalchemy.exc import IntegrityError
 
+from archive import archiver, list_months
+from broadcast import CANCELLED, RUNNING, broadcast_runner, format_progress, progress_keyboard, running_broadcast
+from catalog import get_catalog, reload_catalog, refresh_periodically
 from config import config
-from database import get_db, init_db
-from models import BotSettings, Button, FormResponse, AdminSettings
+from export import (
+    ExportFilter, MAX_DOCUMENT_SIZE, export_archive, export_lock, export_responses, last_days, parse_date_range,
+)
+from filecache import send_button_file
+from forms import END, FormProgress, compile_form
+from idempotency import duplicates_total, recent_submissions, submission_fingerprint, update_dedup_middleware
+import metrics
+from database import dispose_engines, get_db, init_db, lazy_db
+from models import BotSettings, Button, AdminSettings, Broadcast, DEFAULT_TENANT_ID
+from notifier import notification_sender
+from search import format_hits, search_keyboard, search_responses
+from stats import click_collector, load_report, format_report
+from storage import create_storage
+from startup import startup_timer
+from submissions import Submission, submission_queue
+from tenants import TenantEntry, tenant_middleware, tenant_registry
+from throttling import create_throttling
+from users import count_reachable, user_collector
+from webhook import run_webhook
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+startup_timer.mark("импорт модулей")
+
+DUPLICATE_TEXT = "✅ Эта заявка уже принята, свяжемся в течение 2 часов."
 
 
 class UserForm(StatesGroup):
@@ -33,169 +57,215 @@ class AdminPanel(StatesGroup):
     button_response_content = State()
     button_questions = State()
     requests_chat = State()
+    export_range = State()
+    broadcast_message = State()
+    search_query = State()
 
 
 user_router = Router()
 admin_router = Router()
 
+# Метрики снаружи сессии БД: в замер входит и её фиксация
+for router in (user_router, admin_router):
+    router.message.middleware(metrics.metrics_middleware)
+    router.callback_query.middleware(metrics.metrics_middleware)
+
 
 @user_router.message.middleware()
 @user_router.callback_query.middleware()
 @admin_router.message.middleware()
 @admin_router.callback_query.middleware()
 async def db_session_middleware(handler, event, data):
-    with get_db() as session:
+    async with lazy_db() as (session, stats):
         data["session"] = session
-        return await handler(event, data)
-
-
-def get_main_keyboard(session):
-    buttons = session.query(Button).filter(Button.is_active == True).order_by(Button.order).all()
-    if not buttons:
-        return None
-    kb = []
-    row = []
-    for btn in buttons:
-        row.append(KeyboardButton(text=btn.text))
-        if len(row) == 2:
-            kb.append(row)
-            row = []
-    if row:
-        kb.append(row)
-    return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
+        data["db_stats"] = stats
+        try:
+            return await handler(event, data)
+        finally:
+            logger.debug(f"БД за апдейт: соединений={stats.connections}, запросов={stats.queries}")
 
 
 @user_router.message(UserForm.in_progress)
-async def handle_form_input(message: Message, session, state: FSMContext, bot: Bot):
-    data = await state.get_data()
-    answers = data.get("answers", [])
-    questions = data["questions"]
-    answers.append(message.text)
+async def handle_form_input(message: Message, session, state: FSMContext, tenant: TenantEntry):
+    catalog = get_catalog(tenant.id)
+    progress = FormProgress.from_state(await state.get_data())
+    button = catalog.buttons_by_id.get(progress.form_id) if progress else None
+    form = button.form if button else None
+    if form is None or not 0 <= progress.step < len(form.steps):
+        # Кнопку удалили или анкету поменяли, пока пользователь её заполнял
+        await state.clear()
+        await message.answer("Анкета изменилась. Выберите пункт меню ещё раз 👇", reply_markup=catalog.keyboard)
+        return
+
+    step = form.steps[progress.step]
+    text = message.text
+    if text is None and message.contact is not None:
+        text = message.contact.phone_number
+    if text is None:
+        await message.answer("Пожалуйста, ответьте текстом.")
+        return
+    answer = step.validate(text)
+    if answer is None:
+        await message.answer(f"⚠️ {step.error}", reply_markup=step.keyboard)
+        return
 
-    if len(answers) < len(questions):
-        await state.update_data(answers=answers)
-        await message.answer(questions[len(answers)])
+    if progress.record(form, answer) != END:
+        await state.set_data(progress.to_state())
+        next_step = form.steps[progress.step]
+        await message.answer(next_step.text, reply_markup=next_step.keyboard)
     else:
-        button_id = data["form_button_id"]
-        json_answers = json.dumps(answers, ensure_ascii=False)
-        current_time = datetime.now().strftime("%H:%M")
+        answers = progress.answers
+        submitted_at = datetime.now()
+        current_time = submitted_at.strftime("%H:%M")
+        name = answers[0] if len(answers) > 0 and answers[0] is not None else "—"
+        task = answers[1] if len(answers) > 1 and answers[1] is not None else "—"
+        contact = answers[2] if len(answers) > 2 and answers[2] is not None else "—"
+        text = (
+            "📋 НОВАЯ ЗАЯВКА\n"
+            f"Имя: {name}\n"
+            f"Задача: {task}\n"
+            f"Контакт: {contact}\n"
+            f"Время: {current_time}\n"
+            f"Пользователь: @{message.from_user.username or '—'} (ID: {message.from_user.id})"
+        )
+
+        # Двойное нажатие или повторная отправка той же анкеты: ни записи, ни уведомления
+        fingerprint = submission_fingerprint(tenant.id, message.from_user.id, progress.form_id, answers)
+        if not recent_submissions.add(fingerprint):
+            duplicates_total.inc("submission")
+            logger.info(f"Повтор заявки пропущен: user={message.from_user.id}")
+            await state.clear()
+            await message.answer(DUPLICATE_TEXT, reply_markup=catalog.keyboard)
+            return
 
+        submission = Submission(
+            tenant_id=tenant.id,
+            user_id=message.from_user.id,
+            button_id=progress.form_id,
+            answers=answers,
+            submitted_at=submitted_at,
+            notify_chat_id=catalog.requests_chat_id,
+            notify_text=text
+        )
         try:
-            resp = FormResponse(
-                user_id=message.from_user.id,
-                button_id=button_id,
-                answers=json_answers,
-                created_at=current_time
-            )
-            session.add(resp)
-            session.commit()
+            # Уведомление в группу уходит фоном из outbox, пользователь его не ждёт
+            await submission_queue.submit(submission)
             logger.info(f"Заявка сохранена: user={message.from_user.id}")
         except Exception as e:
-            session.rollback()
             logger.error(f"Ошибка БД: {e}")
+            recent_submissions.discard(fingerprint)
             await message.answer("Ошибка при отправке заявки. Попробуйте позже.")
             await state.clear()
             return
 
-        try:
-            admin_settings = session.query(AdminSettings).first()
-            if admin_settings and admin_settings.requests_chat_id:
-                name = answers[0] if len(answers) > 0 else "—"
-                task = answers[1] if len(answers) > 1 else "—"
-                contact = answers[2] if len(answers) > 2 else "—"
-
-                text = (
-                    "📋 НОВАЯ ЗАЯВКА\n"
-                    f"Имя: {name}\n"
-                    f"Задача: {task}\n"
-                    f"Контакт: {contact}\n"
-                    f"Время: {current_time}\n"
-                    f"Пользователь: @{message.from_user.username or '—'} (ID: {message.from_user.id})"
-                )
-                await bot.send_message(chat_id=admin_settings.requests_chat_id, text=text)
-                logger.info("Заявка отправлена в группу")
-        except Exception as e:
-            logger.error(f"Ошибка отправки: {e}")
-
-        await message.answer("✅ Спасибо! Заявка передана, свяжемся в течение 2 часов.")
         await state.clear()
+        if submission.duplicate:
+            await message.answer(DUPLICATE_TEXT, reply_markup=catalog.keyboard)
+            return
+        await message.answer("✅ Спасибо! Заявка передана, свяжемся в течение 2 часов.",
+                             reply_markup=catalog.keyboard)
 
 
 @user_router.message(F.text & ~F.text.startswith("/"), StateFilter(None))
-async def handle_menu_click(message: Message, session, state: FSMContext):
-    button = session.query(Button).filter(
-        Button.text == message.text,
-        Button.is_active == True
-    ).first()
+async def handle_menu_click(message: Message, session, state: FSMContext, tenant: TenantEntry):
+    user_collector.record(message.from_user)
+    button = get_catalog(tenant.id).buttons.get(message.text)
 
     if not button:
         await message.answer("Пожалуйста, используйте кнопки из меню 👇")
         return
+    click_collector.record_click(button.id)
 
     if button.response_type == "text":
         await message.answer(button.response_content or "Информация скоро появится")
     elif button.response_type == "file":
-        if button.response_content and os.path.exists(button.response_content):
-            from aiogram.types import FSInputFile
-            await message.answer_document(document=FSInputFile(button.response_content))
-        else:
-            await message.answer("Файл не найден.")
+        await send_button_file(message, session, button, tenant.id)
     elif button.response_type == "link":
         await message.answer(f"🔗 {button.response_content}")
     elif button.response_type == "form":
-        questions = json.loads(button.form_questions) if button.form_questions else ["Ваше имя?"]
-        await state.update_data(form_button_id=button.id, questions=questions, answers=[])
+        if button.form is None:
+            await message.answer("Анкета временно недоступна. Попробуйте позже.")
+            return
+        await state.set_data(FormProgress(form_id=button.id, step=0, answers=[]).to_state())
         await state.set_state(UserForm.in_progress)
-        await message.answer(questions[0])
+        first = button.form.steps[0]
+        await message.answer(first.text, reply_markup=first.keyboard)
 
 
 @user_router.message(Command("start"))
-async def cmd_start(message: Message, session):
-    settings = session.query(BotSettings).first()
-    reply_markup = get_main_keyboard(session)
-    if settings.greeting_photo:
-        await message.answer_photo(photo=settings.greeting_photo, caption=settings.greeting_text,
-                                   reply_markup=reply_markup)
+async def cmd_start(message: Message, session, tenant: TenantEntry):
+    if message.from_user and not message.from_user.is_bot:
+        user_collector.record(message.from_user)
+    catalog = get_catalog(tenant.id)
+    if catalog.greeting_photo:
+        await message.answer_photo(photo=catalog.greeting_photo, caption=catalog.greeting_text,
+                                   reply_markup=catalog.keyboard)
     else:
-        await message.answer(settings.greeting_text, reply_markup=reply_markup)
+        await message.answer(catalog.greeting_text, reply_markup=catalog.keyboard)
 
 
-def is_admin(user_id: int) -> bool:
-    return user_id in config.ADMIN_IDS
+def is_admin(tenant: TenantEntry, user_id: int) -> bool:
+    return user_id in tenant.admin_ids
 
 
-@admin_router.message(Command("panel"))
-async def cmd_panel(message: Message):
-    if not is_admin(message.from_user.id):
-        await message.answer("🚫 Эта команда доступна только администраторам.")
-        return
-    kb = InlineKeyboardMarkup(inline_keyboard=[
+async def bot_settings(session, tenant: TenantEntry) -> BotSettings:
+    return await session.scalar(select(BotSettings).where(BotSettings.tenant_id == tenant.id).limit(1))
+
+
+async def admin_settings(session, tenant: TenantEntry) -> AdminSettings:
+    return await session.scalar(select(AdminSettings).where(AdminSettings.tenant_id == tenant.id).limit(1))
+
+
+async def tenant_button(session, tenant: TenantEntry, btn_id: int):
+    """Кнопка по id из callback_data — только если она принадлежит магазину"""
+    btn = await session.get(Button, btn_id)
+    return btn if btn is not None and btn.tenant_id == tenant.id else None
+
+
+def panel_keyboard() -> InlineKeyboardMarkup:
+    rows = [
         [InlineKeyboardButton(text="👋 Приветствие", callback_data="admin:greeting")],
         [InlineKeyboardButton(text="🔘 Кнопки", callback_data="admin:buttons_list")],
         [InlineKeyboardButton(text="📮 Группа заявок", callback_data="admin:requests")],
-        [InlineKeyboardButton(text="📊 Статистика", callback_data="admin:stats")],
+        [InlineKeyboardButton(text="📣 Рассылка", callback_data="admin:broadcast")],
+        [InlineKeyboardButton(text="📊 Статистика", callback_data="admin:stats"),
+         InlineKeyboardButton(text="📤 Выгрузка", callback_data="admin:export")],
+        [InlineKeyboardButton(text="🔎 Поиск заявок", callback_data="admin:find"),
+         InlineKeyboardButton(text="🗄 Архив", callback_data="admin:archive")],
         [InlineKeyboardButton(text="👁️ Предпросмотр (/test)", callback_data="admin:test")]
-    ])
-    await message.answer("🛠 Панель управления:", reply_markup=kb)
+    ]
+    if config.MULTI_TENANT:
+        # Пользователи общие для всех ботов процесса — рассылка пока только в режиме одного бота
+        del rows[3]
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+@admin_router.message(Command("panel"))
+async def cmd_panel(message: Message, tenant: TenantEntry):
+    if not is_admin(tenant, message.from_user.id):
+        await message.answer("🚫 Эта команда доступна только администраторам.")
+        return
+    await message.answer("🛠 Панель управления:", reply_markup=panel_keyboard())
 
 
 @admin_router.message(Command("setgroup"))
-async def set_group_from_chat(message: Message, session):
-    if not is_admin(message.from_user.id):
+async def set_group_from_chat(message: Message, session, tenant: TenantEntry):
+    if not is_admin(tenant, message.from_user.id):
         return
     if message.chat.type in ("group", "supergroup"):
         chat_id = message.chat.id
-        settings = session.query(AdminSettings).first()
+        settings = await admin_settings(session, tenant)
         settings.requests_chat_id = chat_id
-        session.commit()
+        await session.commit()
+        await reload_catalog(session, tenant.id)
         await message.answer("✅ Эта группа установлена для заявок!")
     else:
         await message.answer("Отправьте /setgroup в нужной группе")
 
 
 @admin_router.callback_query(F.data == "admin:greeting")
-async def admin_greeting(callback: CallbackQuery, session):
-    settings = session.query(BotSettings).first()
+async def admin_greeting(callback: CallbackQuery, session, tenant: TenantEntry):
+    settings = await bot_settings(session, tenant)
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="✏️ Изменить текст", callback_data="admin:greeting_edit")],
         [InlineKeyboardButton(text="🖼️ Установить фото", callback_data="admin:greeting_photo")],
@@ -216,13 +286,14 @@ async def admin_greeting_edit(callback: CallbackQuery, state: FSMContext):
 
 
 @admin_router.message(AdminPanel.greeting_text)
-async def admin_greeting_save(message: Message, session, state: FSMContext):
-    settings = session.query(BotSettings).first()
+async def admin_greeting_save(message: Message, session, state: FSMContext, tenant: TenantEntry):
+    settings = await bot_settings(session, tenant)
     settings.greeting_text = message.text
-    session.commit()
+    await session.commit()
+    await reload_catalog(session, tenant.id)
     await message.answer("✅ Текст обновлён!")
     await state.clear()
-    await cmd_panel(message)
+    await cmd_panel(message, tenant)
 
 
 @admin_router.callback_query(F.data == "admin:greeting_photo")
@@ -232,28 +303,30 @@ async def admin_greeting_photo(callback: CallbackQuery, state: FSMContext):
 
 
 @admin_router.message(AdminPanel.greeting_photo, F.photo)
-async def admin_greeting_photo_save(message: Message, session, state: FSMContext):
+async def admin_greeting_photo_save(message: Message, session, state: FSMContext, tenant: TenantEntry):
     file_id = message.photo[-1].file_id
-    settings = session.query(BotSettings).first()
+    settings = await bot_settings(session, tenant)
     settings.greeting_photo = file_id
-    session.commit()
+    await session.commit()
+    await reload_catalog(session, tenant.id)
     await message.answer("✅ Фото установлено!")
     await state.clear()
-    await cmd_panel(message)
+    await cmd_panel(message, tenant)
 
 
 @admin_router.callback_query(F.data == "admin:greeting_photo_del")
-async def admin_greeting_photo_del(callback: CallbackQuery, session):
-    settings = session.query(BotSettings).first()
+async def admin_greeting_photo_del(callback: CallbackQuery, session, tenant: TenantEntry):
+    settings = await bot_settings(session, tenant)
     settings.greeting_photo = None
-    session.commit()
+    await session.commit()
+    await reload_catalog(session, tenant.id)
     await callback.answer("✅ Фото удалено", show_alert=True)
-    await admin_greeting(callback, session)
+    await admin_greeting(callback, session, tenant)
 
 
 @admin_router.callback_query(F.data == "admin:buttons_list")
-async def admin_buttons_list(callback: CallbackQuery, session):
-    buttons = session.query(Button).order_by(Button.order).all()
+async def admin_buttons_list(callback: CallbackQuery, session, tenant: TenantEntry):
+    buttons = (await session.scalars(select(Button).where(Button.tenant_id == tenant.id).order_by(Button.order))).all()
     kb = []
     for btn in buttons:
         status = "✅" if btn.is_active else "❌"
@@ -270,13 +343,19 @@ async def admin_btn_add_start(callback: CallbackQuery, state: FSMContext):
 
 
 @admin_router.message(AdminPanel.new_button_text)
-async def admin_btn_add_text(message: Message, session, state: FSMContext):
+async def admin_btn_add_text(message: Message, session, state: FSMContext, tenant: TenantEntry):
     text = message.text.strip()
-    max_order = session.query(Button.order).order_by(Button.order.desc()).first()
-    new_order = (max_order[0] + 1) if max_order else 1
-    btn = Button(text=text, order=new_order, is_active=True, response_type="text", response_content="")
+    max_order = await session.scalar(select(func.max(Button.order)).where(Button.tenant_id == tenant.id))
+    new_order = (max_order + 1) if max_order is not None else 1
+    btn = Button(tenant_id=tenant.id, text=text, order=new_order, is_active=True, response_type="text", response_content="")
     session.add(btn)
-    session.commit()
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        await message.answer("⚠️ Кнопка с таким текстом уже есть. Введите другой текст:")
+        return
+    await reload_catalog(session, tenant.id)
     await message.answer(f"✅ Кнопка '{text}' создана.", reply_markup=InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📝 Текст", callback_data=f"admin:btn_set_type:{btn.id}:text")],
         [InlineKeyboardButton(text="📎 Файл", callback_data=f"admin:btn_set_type:{btn.id}:file")],
@@ -287,22 +366,24 @@ async def admin_btn_add_text(message: Message, session, state: FSMContext):
 
 
 @admin_router.callback_query(F.data.startswith("admin:btn_set_type:"))
-async def admin_btn_set_type(callback: CallbackQuery, session, state: FSMContext):
+async def admin_btn_set_type(callback: CallbackQuery, session, state: FSMContext, tenant: TenantEntry):
     _, _, btn_id, resp_type = callback.data.split(":")
     btn_id = int(btn_id)
-    btn = session.query(Button).filter(Button.id == btn_id).first()
+    btn = await tenant_button(session, tenant, btn_id)
     if not btn:
         await callback.answer("Кнопка не найдена", show_alert=True)
         return
 
     btn.response_type = resp_type
-    session.commit()
+    await session.commit()
+    await reload_catalog(session, tenant.id)
 
     prompts = {
         "text": "Введите текст ответа:",
         "link": "Введите URL:",
         "file": "Отправьте PDF или укажите путь (static/prices.pdf):",
-        "form": 'Введите вопросы в формате JSON:\nПример: ["Имя", "Задача", "Контакт"]'
+        "form": ('Введите вопросы в формате JSON:\nПример: ["Имя", "Задача", "Контакт"]\n'
+                 'Чтобы проверять ответ, вместо строки укажите объект: {"text": "Телефон?", "validate": "phone"}')
     }
 
     await callback.message.answer(prompts[resp_type])
@@ -314,45 +395,48 @@ async def admin_btn_set_type(callback: CallbackQuery, session, state: FSMContext
 
 
 @admin_router.message(AdminPanel.button_response_content)
-async def admin_btn_save_content(message: Message, session, state: FSMContext):
+async def admin_btn_save_content(message: Message, session, state: FSMContext, tenant: TenantEntry):
     data = await state.get_data()
     btn_id = data["editing_button_id"]
-    btn = session.query(Button).filter(Button.id == btn_id).first()
+    btn = await tenant_button(session, tenant, btn_id)
     if btn:
         if btn.response_type == "file" and message.document:
             btn.response_content = message.document.file_id
         else:
             btn.response_content = message.text
-        session.commit()
+        btn.cached_file_id = btn.cached_file_mtime = btn.cached_file_size = None
+        await session.commit()
+        await reload_catalog(session, tenant.id)
         await message.answer("✅ Ответ сохранён!")
     await state.clear()
-    await cmd_panel(message)
+    await cmd_panel(message, tenant)
 
 
 @admin_router.message(AdminPanel.button_questions)
-async def admin_btn_save_questions(message: Message, session, state: FSMContext):
+async def admin_btn_save_questions(message: Message, session, state: FSMContext, tenant: TenantEntry):
     try:
-        questions = json.loads(message.text)
-        if not isinstance(questions, list):
-            raise ValueError
-    except Exception:
-        await message.answer("Неверный формат. Используйте JSON-массив строк.")
+        questions = json.loads(message.text or "")
+        compile_form(questions)
+    except ValueError as e:
+        # FormError — тоже ValueError: в тексте ошибки сказано, какой шаг не так
+        await message.answer(f"Неверный формат: {e}\nИспользуйте JSON-массив вопросов.")
         return
 
     data = await state.get_data()
     btn_id = data["editing_button_id"]
-    btn = session.query(Button).filter(Button.id == btn_id).first()
+    btn = await tenant_button(session, tenant, btn_id)
     if btn:
         btn.form_questions = json.dumps(questions, ensure_ascii=False)
-        session.commit()
+        await session.commit()
+        await reload_catalog(session, tenant.id)
         await message.answer("✅ Вопросы сохранены!")
     await state.clear()
-    await cmd_panel(message)
+    await cmd_panel(message, tenant)
 
 
 @admin_router.callback_query(F.data == "admin:requests")
-async def admin_requests(callback: CallbackQuery, session):
-    settings = session.query(AdminSettings).first()
+async def admin_requests(callback: CallbackQuery, session, tenant: TenantEntry):
+    settings = await admin_settings(session, tenant)
     chat_info = f"ID: {settings.requests_chat_id}" if settings.requests_chat_id else "не задана"
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📨 Установить группу", callback_data="admin:req_set")],
@@ -367,45 +451,487 @@ async def admin_req_set(callback: CallbackQuery):
 
 
 @admin_router.callback_query(F.data == "admin:stats")
-async def admin_stats(callback: CallbackQuery, session):
-    total = session.query(FormResponse).count()
+async def admin_stats(callback: CallbackQuery, session, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    await click_collector.flush()
+    button_names = dict((await session.execute(
+        select(Button.id, Button.text).where(Button.tenant_id == tenant.id)
+    )).all())
+    # Счётчики заявок без кнопки остались только от самого первого магазина
+    button_ids = [*button_names, 0] if tenant.id == DEFAULT_TENANT_ID else list(button_names)
+    report = await load_report(session, button_ids)
     await callback.message.edit_text(
-        f"📊 Статистика:\nВсего заявок: {total}",
+        format_report(report, button_names),
         reply_markup=InlineKeyboardMarkup(
             inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:main")]])
     )
 
 
+@admin_router.callback_query(F.data == "admin:export")
+async def admin_export(callback: CallbackQuery, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    rows = [[InlineKeyboardButton(text="Все кнопки", callback_data="admin:exp_btn:0")]]
+    for button in get_catalog(tenant.id).buttons.values():
+        if button.response_type == "form":
+            rows.append([InlineKeyboardButton(text=button.text, callback_data=f"admin:exp_btn:{button.id}")])
+    rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:main")])
+    await callback.message.edit_text("📤 Заявки какой кнопки выгрузить?",
+                                     reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+
+
+@admin_router.callback_query(F.data.startswith("admin:exp_btn:"))
+async def admin_export_button(callback: CallbackQuery, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    btn_id = int(callback.data.split(":")[2])
+    periods = [("Всё время", 0), ("Сегодня", 1), ("7 дней", 7), ("30 дней", 30)]
+    rows = [[InlineKeyboardButton(text=title, callback_data=f"admin:exp_per:{btn_id}:{days}")]
+            for title, days in periods]
+    rows.append([InlineKeyboardButton(text="📅 Свой период", callback_data=f"admin:exp_custom:{btn_id}")])
+    rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:export")])
+    await callback.message.edit_text("📅 За какой период?", reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+
+
+def export_format_keyboard(flt: ExportFilter) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="CSV (Excel)", callback_data=f"admin:exp_run:{replace(flt, fmt='csv').pack()}"),
+         InlineKeyboardButton(text="JSONL", callback_data=f"admin:exp_run:{replace(flt, fmt='jsonl').pack()}")],
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:export")]
+    ])
+
+
+@admin_router.callback_query(F.data.startswith("admin:exp_per:"))
+async def admin_export_period(callback: CallbackQuery, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    _, _, btn_id, days = callback.data.split(":")
+    date_from, date_to = last_days(int(days))
+    await callback.message.edit_text("📄 В каком формате?",
+                                     reply_markup=export_format_keyboard(ExportFilter(int(btn_id) or None, date_from, date_to)))
+
+
+@admin_router.callback_query(F.data.startswith("admin:exp_custom:"))
+async def admin_export_custom(callback: CallbackQuery, state: FSMContext, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    await callback.message.answer("Введите период в формате 01.09.2026-30.09.2026 или одну дату:")
+    await state.update_data(export_button_id=int(callback.data.split(":")[2]))
+    await state.set_state(AdminPanel.export_range)
+
+
+@admin_router.message(AdminPanel.export_range)
+async def admin_export_range(message: Message, state: FSMContext):
+    try:
+        date_from, date_to = parse_date_range(message.text or "")
+    except ValueError:
+        await message.answer("⚠️ Не удалось разобрать период. Пример: 01.09.2026-30.09.2026")
+        return
+    data = await state.get_data()
+    await state.clear()
+    await message.answer("📄 В каком формате?",
+                         reply_markup=export_format_keyboard(ExportFilter(data.get("export_button_id") or None, date_from, date_to)))
+
+
+@admin_router.callback_query(F.data.startswith("admin:exp_run:"))
+async def admin_export_run(callback: CallbackQuery, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    flt = ExportFilter.unpack(callback.data[len("admin:exp_run:"):])
+    if export_lock.locked():
+        await callback.answer("⏳ Другая выгрузка ещё не закончилась", show_alert=True)
+        return
+    await callback.answer()
+    await callback.message.edit_text(f"⏳ Готовлю выгрузку ({flt.describe()})...")
+    fd, path = tempfile.mkstemp(suffix=".gz")
+    os.close(fd)
+    try:
+        async with export_lock:
+            count = await export_responses(flt, path, tenant.id)
+        if not count:
+            await callback.message.edit_text("Заявок по этому фильтру нет.")
+        elif os.path.getsize(path) > MAX_DOCUMENT_SIZE:
+            await callback.message.edit_text("⚠️ Файл больше 50 МБ — выберите период покороче.")
+        else:
+            await callback.message.answer_document(FSInputFile(path, filename=flt.filename()),
+                                                   caption=f"📤 Заявок: {count} ({flt.describe()})")
+            await callback.message.edit_text("✅ Выгрузка готова")
+    finally:
+        os.remove(path)
+
+
+async def show_search_page(message: Message, session, tenant: TenantEntry, query: str, page: int, edit: bool):
+    hits, has_more = await search_responses(session, tenant.id, query, page)
+    text = format_hits(query, hits, page)
+    keyboard = search_keyboard(page, has_more)
+    if edit:
+        await message.edit_text(text, reply_markup=keyboard)
+    else:
+        await message.answer(text, reply_markup=keyboard)
+
+
+@admin_router.message(Command("find"))
+async def cmd_find(message: Message, session, state: FSMContext, tenant: TenantEntry):
+    if not is_admin(tenant, message.from_user.id):
+        await message.answer("🚫 Эта команда доступна только администраторам.")
+        return
+    query = (message.text or "").partition(" ")[2].strip()
+    if not query:
+        await message.answer("🔎 Введите имя, телефон или слово из заявки:")
+        await state.set_state(AdminPanel.search_query)
+        return
+    # Запрос хранится в данных FSM: в callback_data (64 байта) он может не влезть
+    await state.update_data(search_query=query)
+    await show_search_page(message, session, tenant, query, 0, edit=False)
+
+
+@admin_router.callback_query(F.data == "admin:find")
+async def admin_find(callback: CallbackQuery, state: FSMContext, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    await callback.message.answer("🔎 Введите имя, телефон или слово из заявки:")
+    await state.set_state(AdminPanel.search_query)
+    await callback.answer()
+
+
+@admin_router.message(AdminPanel.search_query)
+async def admin_find_query(message: Message, session, state: FSMContext, tenant: TenantEntry):
+    query = (message.text or "").strip()
+    if not query:
+        await message.answer("⚠️ Отправьте текст для поиска")
+        return
+    await state.clear()
+    await state.update_data(search_query=query)
+    await show_search_page(message, session, tenant, query, 0, edit=False)
+
+
+@admin_router.callback_query(F.data.startswith("admin:find_page:"))
+async def admin_find_page(callback: CallbackQuery, session, state: FSMContext, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    query = (await state.get_data()).get("search_query")
+    if not query:
+        await callback.answer("Поиск устарел — начните новый", show_alert=True)
+        return
+    await show_search_page(callback.message, session, tenant, query, int(callback.data.split(":")[2]), edit=True)
+    await callback.answer()
+
+
+@admin_router.callback_query(F.data == "admin:archive")
+async def admin_archive(callback: CallbackQuery, session, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    rows = []
+    for item in await list_months(session, tenant.id):
+        if item.restored:
+            title = f"♻️ {item.month} · в таблице заявок"
+        elif item.restore_requested:
+            title = f"⏳ {item.month} · возвращается"
+        else:
+            title = f"🗄 {item.month} · {item.rows} заявок"
+        rows.append([InlineKeyboardButton(text=title, callback_data=f"admin:arc:{item.month}")])
+    rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:main")])
+    if len(rows) > 1:
+        text = "🗄 Архив заявок по месяцам. Статистика учитывает и архивные заявки."
+    elif archiver.enabled:
+        text = f"🗄 Архив пуст: в него попадают заявки старше {archiver.after_days} дней."
+    else:
+        text = "🗄 Архив пуст: архивирование выключено (ARCHIVE_AFTER_DAYS в .env)."
+    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+
+
+@admin_router.callback_query(F.data.startswith("admin:arc:"))
+async def admin_archive_month(callback: CallbackQuery, session, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    month = callback.data.split(":")[2]
+    item = next((item for item in await list_months(session, tenant.id) if item.month == month), None)
+    if item is None:
+        await callback.answer("Такого месяца в архиве нет", show_alert=True)
+        return
+    if item.restored:
+        text = f"♻️ Заявки за {month} возвращены в таблицу и не архивируются."
+        rows = [[InlineKeyboardButton(text="🗄 Снова архивировать", callback_data=f"admin:arc_release:{month}")]]
+    elif item.restore_requested:
+        text = f"⏳ Заявки за {month} возвращаются в таблицу."
+        rows = []
+    else:
+        text = f"🗄 Архив за {month}: {item.rows} заявок."
+        rows = [
+            [InlineKeyboardButton(text="CSV (Excel)", callback_data=f"admin:arc_exp:{month}:csv"),
+             InlineKeyboardButton(text="JSONL", callback_data=f"admin:arc_exp:{month}:jsonl")],
+            [InlineKeyboardButton(text="♻️ Вернуть в таблицу заявок", callback_data=f"admin:arc_restore:{month}")],
+        ]
+    rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:archive")])
+    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+
+
+@admin_router.callback_query(F.data.startswith("admin:arc_exp:"))
+async def admin_archive_export(callback: CallbackQuery, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    _, _, month, fmt = callback.data.split(":")
+    if export_lock.locked():
+        await callback.answer("⏳ Другая выгрузка ещё не закончилась", show_alert=True)
+        return
+    await callback.answer()
+    await callback.message.edit_text(f"⏳ Готовлю выгрузку архива за {month}...")
+    fd, path = tempfile.mkstemp(suffix=".gz")
+    os.close(fd)
+    try:
+        async with export_lock:
+            count = await export_archive(tenant.id, month, fmt, path)
+        if os.path.getsize(path) > MAX_DOCUMENT_SIZE:
+            await callback.message.edit_text("⚠️ Файл больше 50 МБ — Telegram его не примет.")
+        else:
+            await callback.message.answer_document(FSInputFile(path, filename=f"applications_{month}.{fmt}.gz"),
+                                                   caption=f"📤 Архив за {month}: {count} заявок")
+            await callback.message.edit_text("✅ Выгрузка готова")
+    except FileNotFoundError:
+        await callback.message.edit_text("⚠️ Файл архива не найден.")
+    finally:
+        os.remove(path)
+
+
+@admin_router.callback_query(F.data.startswith("admin:arc_restore:"))
+async def admin_archive_restore(callback: CallbackQuery, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    month = callback.data.split(":")[2]
+    # Возвращает фоновый архиватор: только он дописывает архивные файлы
+    if not await archiver.request_restore(tenant.id, month):
+        await callback.answer("Месяц уже возвращён", show_alert=True)
+        return
+    await callback.answer()
+    await callback.message.edit_text(
+        f"⏳ Заявки за {month} вернутся в таблицу в течение минуты. Они станут доступны в поиске "
+        "и выгрузке и не будут архивироваться, пока месяц не отправят в архив снова.",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:archive")]])
+    )
+
+
+@admin_router.callback_query(F.data.startswith("admin:arc_release:"))
+async def admin_archive_release(callback: CallbackQuery, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    month = callback.data.split(":")[2]
+    await archiver.release(tenant.id, month)
+    await callback.answer("Месяц уйдёт в архив при следующем переносе", show_alert=True)
+    await callback.message.edit_text(
+        f"🗄 Заявки за {month} снова будут перенесены в архив.",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:archive")]])
+    )
+
+
+@admin_router.callback_query(F.data == "admin:broadcast")
+async def admin_broadcast(callback: CallbackQuery, session, state: FSMContext, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    if config.MULTI_TENANT:
+        await callback.answer("Рассылка доступна только в режиме одного бота", show_alert=True)
+        return
+    await user_collector.flush()
+    broadcast = await running_broadcast(session)
+    if broadcast is not None:
+        await callback.message.edit_text(format_progress(broadcast), reply_markup=progress_keyboard(broadcast))
+        return
+    reachable = await count_reachable(session)
+    await callback.message.edit_text(
+        f"📣 Рассылку получат пользователей: {reachable}\n\n"
+        "Отправьте сообщение для рассылки — текст, фото, документ, как есть.",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:main")]
+        ])
+    )
+    await state.set_state(AdminPanel.broadcast_message)
+
+
+@admin_router.message(AdminPanel.broadcast_message)
+async def admin_broadcast_message(message: Message, session, state: FSMContext):
+    await state.clear()
+    reachable = await count_reachable(session)
+    # Рассылается копия этого сообщения, поэтому удалять его до конца рассылки нельзя
+    await message.reply(
+        f"Отправить это сообщение {reachable} пользователям?",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Отправить",
+                                  callback_data=f"admin:bc_send:{message.chat.id}:{message.message_id}")],
+            [InlineKeyboardButton(text="❌ Отмена", callback_data="admin:main")]
+        ])
+    )
+
+
+@admin_router.callback_query(F.data.startswith("admin:bc_send:"))
+async def admin_broadcast_send(callback: CallbackQuery, session, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    if config.MULTI_TENANT:
+        await callback.answer("Рассылка доступна только в режиме одного бота", show_alert=True)
+        return
+    _, _, chat_id, message_id = callback.data.split(":")
+    if await running_broadcast(session) is not None:
+        await callback.answer("Другая рассылка ещё идёт", show_alert=True)
+        return
+    # Иначе в total не попадут пользователи, писавшие за последние USERS_FLUSH_SECONDS
+    await user_collector.flush()
+    broadcast = Broadcast(
+        source_chat_id=int(chat_id),
+        source_message_id=int(message_id),
+        status=RUNNING,
+        created_at=datetime.now(),
+        total=await count_reachable(session),
+        progress_chat_id=callback.message.chat.id,
+        progress_message_id=callback.message.message_id,
+    )
+    session.add(broadcast)
+    await session.commit()
+    logger.info(f"Рассылка {broadcast.id} запущена админом {callback.from_user.id}")
+    await callback.message.edit_text(format_progress(broadcast), reply_markup=progress_keyboard(broadcast))
+    broadcast_runner.wake()
+
+
+@admin_router.callback_query(F.data.startswith("admin:bc_stop:"))
+async def admin_broadcast_stop(callback: CallbackQuery, session, tenant: TenantEntry):
+    if not is_admin(tenant, callback.from_user.id):
+        return
+    broadcast_id = int(callback.data.split(":")[2])
+    await session.execute(
+        update(Broadcast)
+        .where(Broadcast.id == broadcast_id, Broadcast.status == RUNNING)
+        .values(status=CANCELLED, finished_at=datetime.now())
+    )
+    await session.commit()
+    broadcast = await session.get(Broadcast, broadcast_id, populate_existing=True)
+    if broadcast is not None:
+        await callback.message.edit_text(format_progress(broadcast), reply_markup=progress_keyboard(broadcast))
+    await callback.answer("Рассылка остановится после текущей пачки")
+
+
 @admin_router.callback_query(F.data == "admin:test")
-async def admin_test(callback: CallbackQuery, session):
-    await cmd_start(callback.message, session)
+async def admin_test(callback: CallbackQuery, session, tenant: TenantEntry):
+    await cmd_start(callback.message, session, tenant)
     await callback.answer("👁️ Предпросмотр отправлен", show_alert=True)
 
 
 @admin_router.callback_query(F.data == "admin:main")
 async def admin_main(callback: CallbackQuery):
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="👋 Приветствие", callback_data="admin:greeting")],
-        [InlineKeyboardButton(text="🔘 Кнопки", callback_data="admin:buttons_list")],
-        [InlineKeyboardButton(text="📮 Группа заявок", callback_data="admin:requests")],
-        [InlineKeyboardButton(text="📊 Статистика", callback_data="admin:stats")],
-        [InlineKeyboardButton(text="👁️ Предпросмотр (/test)", callback_data="admin:test")]
-    ])
-    await callback.message.edit_text("🛠 Панель управления:", reply_markup=kb)
+    await callback.message.edit_text("🛠 Панель управления:", reply_markup=panel_keyboard())
     await callback.answer()
 
 
-async def main():
-    logger.info("Инициализация...")
-    init_db()
-    bot = Bot(token=config.BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+_background_tasks = set()
+_metrics_server = None
+
+
+def _served_tenant_ids():
+    return [tenant.id for tenant in tenant_registry.tenants() if tenant_registry.bot(tenant.id) is not None]
+
+
+async def on_startup(bot: Bot, bots=None):
+    global _metrics_server
+    for tenant_bot in bots or [bot]:
+        # Боты делят HTTP-сессию, повторно она не инструментируется
+        metrics.instrument_bot(tenant_bot)
+        tenant_registry.bind(tenant_bot)
+    for tenant_id in _served_tenant_ids():
+        async with get_db() as session:
+            await reload_catalog(session, tenant_id)
+    submission_queue.start()
+    click_collector.start()
+    user_collector.start()
+    if config.RUN_BACKGROUND_JOBS:
+        notification_sender.start()
+        archiver.start()
+        if not config.MULTI_TENANT:
+            broadcast_runner.start(bot)
+    if config.CATALOG_REFRESH_SECONDS > 0:
+        _background_tasks.add(asyncio.create_task(
+            refresh_periodically(config.CATALOG_REFRESH_SECONDS, _served_tenant_ids)
+        ))
+    if config.METRICS_PORT and _metrics_server is None:
+        _metrics_server = await metrics.start_server(config.METRICS_HOST, config.METRICS_PORT)
+    startup_timer.mark("каталог и фоновые задачи")
+
+
+async def on_shutdown():
+    global _metrics_server
+    if _metrics_server is not None:
+        await _metrics_server.cleanup()
+        _metrics_server = None
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    await submission_queue.stop()
+    await click_collector.stop()
+    await user_collector.stop()
+    await notification_sender.stop()
+    await archiver.stop()
+    await broadcast_runner.stop()
+
+
+def build_dispatcher(storage=None) -> Dispatcher:
+    """Собирает диспетчер со всеми роутерами и фоновыми задачами"""
+    dp = Dispatcher(storage=storage or create_storage())
+    dp.update.outer_middleware(startup_timer.first_update_middleware)
+    dp.update.outer_middleware(metrics.count_update)
+    # Повторно доставленные апдейты отбрасываются раньше всего остального
+    dp.update.outer_middleware(update_dedup_middleware)
+    # Магазин апдейта нужен и лимитам частоты, и хендлерам
+    dp.update.outer_middleware(tenant_middleware)
+    throttling = create_throttling()
+    if throttling:
+        # Внешний middleware: лишние апдейты отбрасываются до хендлеров и сессии БД
+        dp.message.outer_middleware(throttling)
+        dp.callback_query.outer_middleware(throttling)
     dp.include_router(user_router)
     dp.include_router(admin_router)
-    await bot.delete_webhook(drop_pending_updates=True)
-    logger.info("Бот запущен")
-    await dp.start_polling(bot)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+def create_bots() -> List[Bot]:
+    """По боту на магазин; все боты делят одну HTTP-сессию и её пул соединений"""
+    tenants = tenant_registry.tenants()
+    # В режиме polling каждый бот постоянно держит одно соединение long polling
+    session = AiohttpSession(limit=100 + len(tenants))
+    return [Bot(token=tenant.token, session=session) for tenant in tenants]
+
+
+async def create_app() -> Tuple[Dispatcher, List[Bot]]:
+    """Фабрика приложения: проверяет настройки, готовит БД, создаёт ботов и диспетчер.
+    Импорт модулей бота ничего из этого не делает"""
+    config.validate()
+    await init_db()
+    startup_timer.mark("база данных")
+    bots = create_bots()
+    if not bots:
+        raise RuntimeError("Нет активных магазинов: добавьте их командой python tenants.py add")
+    return build_dispatcher(), bots
+
+
+async def main():
+    logger.info("Инициализация...")
+    dp, bots = await create_app()
+    try:
+        if config.WEBHOOK_URL:
+            logger.info(f"Бот запущен в режиме вебхука (ботов: {len(bots)})")
+            await run_webhook(dp, bots)
+        else:
+            # Запросы ко всем ботам сразу: при десятках магазинов последовательно это секунды
+            await asyncio.gather(*(bot.delete_webhook(drop_pending_updates=config.DROP_PENDING_UPDATES)
+                                   for bot in bots))
+            startup_timer.mark("сброс вебхука")
+            logger.info(f"Бот запущен (ботов: {len(bots)})")
+            await dp.start_polling(*bots)
+    finally:
+        await dispose_engines()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,235 @@
+"""Рассылка сообщения всем пользователям бота.
+
+Рассылка — строка в таблице broadcasts, поэтому переживает перезапуск:
+фоновая задача идёт по пользователям в порядке id пачками и после каждой
+пачки сохраняет контрольную точку. После сбоя повторно получат сообщение
+не больше одной пачки пользователей.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime
+from typing import List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+    TelegramRetryAfter, TelegramServerError,
+)
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import false, select, update
+
+from config import config
+from database import get_db
+from metrics import registry
+from models import Broadcast, User
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+
+SENT = "sent"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+IDLE_POLL_SECONDS = 30
+PROGRESS_INTERVAL_SECONDS = 5
+MAX_ATTEMPTS = 5
+
+broadcast_messages = registry.counter("bot_broadcast_messages_total", "Сообщения рассылки по результату", ["result"])
+
+
+def format_progress(broadcast: Broadcast) -> str:
+    title = {RUNNING: "📣 Рассылка идёт", DONE: "✅ Рассылка завершена", CANCELLED: "⛔ Рассылка остановлена"}
+    done = broadcast.sent + broadcast.failed + broadcast.blocked
+    return (
+        f"{title.get(broadcast.status, broadcast.status)} (#{broadcast.id})\n"
+        f"Обработано: {done} из {broadcast.total}\n"
+        f"Доставлено: {broadcast.sent}\n"
+        f"Заблокировали бота: {broadcast.blocked}\n"
+        f"Ошибки: {broadcast.failed}"
+    )
+
+
+def progress_keyboard(broadcast: Broadcast) -> Optional[InlineKeyboardMarkup]:
+    if broadcast.status != RUNNING:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⛔ Остановить", callback_data=f"admin:bc_stop:{broadcast.id}")]
+    ])
+
+
+async def running_broadcast(session) -> Optional[Broadcast]:
+    return await session.scalar(
+        select(Broadcast).where(Broadcast.status == RUNNING).order_by(Broadcast.id).limit(1)
+    )
+
+
+class BroadcastRunner:
+    """Фоновая отправка рассылок.
+
+    Общее ведро токенов держит темп ниже лимита Telegram (около 30 сообщений
+    в секунду на бота), оставляя запас для обычных ответов; семафор
+    ограничивает число одновременных запросов.
+    """
+
+    def __init__(self, rate_per_second: float = 25, concurrency: int = 10, batch_size: int = 500):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self._bucket = TokenBucket(rate=rate_per_second, capacity=max(1.0, rate_per_second))
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._bot: Optional[Bot] = None
+        self._progress_at = 0.0
+
+    def start(self, bot: Bot):
+        if self._task is not None:
+            return
+        self._bot = bot
+        self._task = asyncio.create_task(self._run(), name="broadcast")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def wake(self):
+        """Сообщает, что появилась новая рассылка"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                async with get_db() as session:
+                    broadcast = await running_broadcast(session)
+                if broadcast is not None:
+                    await self._process(broadcast.id)
+                    continue
+            except Exception as e:
+                logger.error(f"Ошибка рассылки: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=IDLE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _process(self, broadcast_id: int):
+        logger.info(f"Рассылка {broadcast_id}: старт")
+        while True:
+            async with get_db() as session:
+                broadcast = await session.get(Broadcast, broadcast_id)
+                # Остановить рассылку можно с любого воркера — статус проверяется между пачками
+                if broadcast is None or broadcast.status != RUNNING:
+                    return
+                user_ids = (await session.scalars(
+                    select(User.id)
+                    .where(User.id > broadcast.last_user_id, User.is_blocked == false())
+                    .order_by(User.id)
+                    .limit(self.batch_size)
+                )).all()
+
+            if not user_ids:
+                await self._finish(broadcast_id)
+                return
+            results = await self._send_batch(broadcast, user_ids)
+            await self._checkpoint(broadcast_id, user_ids, results)
+
+    async def _send_batch(self, broadcast: Broadcast, user_ids: List[int]) -> List[str]:
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def send(user_id: int) -> str:
+            async with slots:
+                return await self._deliver(broadcast, user_id)
+
+        return await asyncio.gather(*(send(user_id) for user_id in user_ids))
+
+    async def _acquire(self):
+        while not self._bucket.try_acquire():
+            await asyncio.sleep(self._bucket.delay())
+
+    async def _deliver(self, broadcast: Broadcast, user_id: int) -> str:
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await self._acquire()
+            try:
+                await self._bot.copy_message(
+                    chat_id=user_id,
+                    from_chat_id=broadcast.source_chat_id,
+                    message_id=broadcast.source_message_id,
+                )
+                result = SENT
+            except TelegramRetryAfter as e:
+                # Флуд-контроль общий для бота — притормаживаем всю рассылку
+                logger.warning(f"Рассылка {broadcast.id}: флуд-контроль, ждём {e.retry_after} с")
+                self._bucket.pause(e.retry_after)
+                continue
+            except TelegramForbiddenError:
+                result = BLOCKED
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logger.warning(f"Рассылка {broadcast.id}: ошибка отправки пользователю {user_id}, попытка {attempt}: {e}")
+                await asyncio.sleep(attempt)
+                continue
+            except (TelegramBadRequest, TelegramAPIError) as e:
+                logger.debug(f"Рассылка {broadcast.id}: пользователю {user_id} не отправлено: {e}")
+                result = FAILED
+            broadcast_messages.inc(result)
+            return result
+        broadcast_messages.inc(FAILED)
+        return FAILED
+
+    async def _checkpoint(self, broadcast_id: int, user_ids: List[int], results: List[str]):
+        counts = Counter(results)
+        blocked = [user_id for user_id, result in zip(user_ids, results) if result == BLOCKED]
+        async with get_db() as session:
+            await session.execute(update(Broadcast).where(Broadcast.id == broadcast_id).values(
+                last_user_id=user_ids[-1],
+                sent=Broadcast.sent + counts[SENT],
+                failed=Broadcast.failed + counts[FAILED],
+                blocked=Broadcast.blocked + counts[BLOCKED],
+            ))
+            if blocked:
+                await session.execute(update(User).where(User.id.in_(blocked)).values(is_blocked=True))
+        if time.monotonic() - self._progress_at >= PROGRESS_INTERVAL_SECONDS:
+            await self._report(broadcast_id)
+
+    async def _finish(self, broadcast_id: int):
+        async with get_db() as session:
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == RUNNING)
+                .values(status=DONE, finished_at=datetime.now())
+            )
+        await self._report(broadcast_id)
+        logger.info(f"Рассылка {broadcast_id}: завершена")
+
+    async def _report(self, broadcast_id: int):
+        """Обновляет у админа сообщение с прогрессом"""
+        self._progress_at = time.monotonic()
+        async with get_db() as session:
+            broadcast = await session.get(Broadcast, broadcast_id)
+        if broadcast is None or broadcast.progress_message_id is None:
+            return
+        try:
+            await self._bot.edit_message_text(
+                text=format_progress(broadcast),
+                chat_id=broadcast.progress_chat_id,
+                message_id=broadcast.progress_message_id,
+                reply_markup=progress_keyboard(broadcast),
+            )
+        except TelegramAPIError as e:
+            logger.debug(f"Не удалось обновить прогресс рассылки: {e}")
+
+
+broadcast_runner = BroadcastRunner(
+    rate_per_second=config.BROADCAST_RATE_PER_SECOND,
+    concurrency=config.BROADCAST_CONCURRENCY,
+    batch_size=config.BROADCAST_BATCH_SIZE,
+)
@@ -0,0 +1,143 @@
+import asyncio
+import itertools
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, Mapping, Optional
+
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from sqlalchemy import select
+
+from database import get_db
+from forms import Form, FormError, compile_form
+from models import BotSettings, Button, AdminSettings, DEFAULT_TENANT_ID
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ButtonEntry:
+    id: int
+    text: str
+    response_type: str
+    response_content: Optional[str]
+    form: Optional[Form]  # скомпилированная анкета для кнопок типа form
+    cached_file_id: Optional[str] = None
+    cached_file_mtime: Optional[float] = None
+    cached_file_size: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Неизменяемый снимок всего, что нужно пользовательским хендлерам одного магазина"""
+    version: int
+    tenant_id: int
+    buttons: Mapping[str, ButtonEntry]  # текст кнопки -> кнопка
+    buttons_by_id: Mapping[int, ButtonEntry]
+    keyboard: Optional[ReplyKeyboardMarkup]
+    greeting_text: str
+    greeting_photo: Optional[str]
+    requests_chat_id: Optional[int]
+    requests_template: Optional[str]
+
+
+_versions = itertools.count(1)
+# Снимки по магазинам: id магазина -> снимок
+_snapshots: Dict[int, CatalogSnapshot] = {}
+# Перезагрузки сериализуются, чтобы более старый снимок не перетёр более новый
+_reload_lock = asyncio.Lock()
+
+
+def build_keyboard(buttons) -> Optional[ReplyKeyboardMarkup]:
+    if not buttons:
+        return None
+    kb = []
+    row = []
+    for btn in buttons:
+        row.append(KeyboardButton(text=btn.text))
+        if len(row) == 2:
+            kb.append(row)
+            row = []
+    if row:
+        kb.append(row)
+    return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
+
+
+def _compile(btn) -> Optional[Form]:
+    if btn.response_type != "form":
+        return None
+    try:
+        return compile_form(btn.form_questions)
+    except FormError as e:
+        logger.error(f"Анкета кнопки {btn.id} не загружена: {e}")
+        return None
+
+
+def get_catalog(tenant_id: int = DEFAULT_TENANT_ID) -> CatalogSnapshot:
+    snapshot = _snapshots.get(tenant_id)
+    if snapshot is None:
+        raise RuntimeError(f"Каталог магазина {tenant_id} не загружен: вызовите reload_catalog()")
+    return snapshot
+
+
+def catalog_versions() -> Dict[int, int]:
+    """Версии загруженных снимков по магазинам"""
+    return {tenant_id: snapshot.version for tenant_id, snapshot in _snapshots.items()}
+
+
+async def reload_catalog(session, tenant_id: int = DEFAULT_TENANT_ID) -> CatalogSnapshot:
+    """Читает кнопки и настройки магазина из БД и атомарно подменяет его снимок"""
+    async with _reload_lock:
+        buttons = (await session.scalars(
+            select(Button).where(Button.tenant_id == tenant_id, Button.is_active == True).order_by(Button.order)
+        )).all()
+        settings = await session.scalar(select(BotSettings).where(BotSettings.tenant_id == tenant_id).limit(1))
+        admin_settings = await session.scalar(
+            select(AdminSettings).where(AdminSettings.tenant_id == tenant_id).limit(1)
+        )
+        return _swap(tenant_id, buttons, settings, admin_settings)
+
+
+def _swap(tenant_id: int, buttons, settings, admin_settings) -> CatalogSnapshot:
+    entries = {}
+    for btn in buttons:
+        # При дублях текста побеждает первая по порядку кнопка, как и в прежнем .first()
+        if btn.text in entries:
+            continue
+        entries[btn.text] = ButtonEntry(
+            id=btn.id,
+            text=btn.text,
+            response_type=btn.response_type,
+            response_content=btn.response_content,
+            form=_compile(btn),
+            cached_file_id=btn.cached_file_id,
+            cached_file_mtime=btn.cached_file_mtime,
+            cached_file_size=btn.cached_file_size,
+        )
+
+    snapshot = CatalogSnapshot(
+        version=next(_versions),
+        tenant_id=tenant_id,
+        buttons=MappingProxyType(entries),
+        buttons_by_id=MappingProxyType({entry.id: entry for entry in entries.values()}),
+        keyboard=build_keyboard(buttons),
+        greeting_text=settings.greeting_text if settings else "",
+        greeting_photo=settings.greeting_photo if settings else None,
+        requests_chat_id=admin_settings.requests_chat_id if admin_settings else None,
+        requests_template=admin_settings.requests_template if admin_settings else None,
+    )
+    # Присваивание ссылки атомарно: хендлеры видят либо старую, либо новую версию целиком
+    _snapshots[tenant_id] = snapshot
+    return snapshot
+
+
+async def refresh_periodically(interval: float, tenant_ids: Callable[[], Iterable[int]]):
+    """Перечитывает каталоги магазинов раз в interval секунд, чтобы подхватить правки из других воркеров"""
+    while True:
+        await asyncio.sleep(interval)
+        for tenant_id in tenant_ids():
+            try:
+                async with get_db() as session:
+                    await reload_catalog(session, tenant_id)
+            except Exception as e:
+                logger.error(f"Ошибка обновления каталога магазина {tenant_id}: {e}")
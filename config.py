@@ -9,10 +9,86 @@ class Config:
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///bot.db")
     REQUESTS_CHAT_ID = int(os.getenv("REQUESTS_CHAT_ID", "0")) if os.getenv("REQUESTS_CHAT_ID", "0").strip() else None
 
-    # Валидация
-    if not BOT_TOKEN:
-        raise ValueError("BOT_TOKEN не указан в .env файле!")
-    if not ADMIN_IDS:
-        raise ValueError("ADMIN_IDS не указаны в .env файле!")
+    # Настройки SQLite (для файловой базы)
+    SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "8"))
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+
+    # Пакетная запись заявок
+    SUBMIT_BATCH_SIZE = int(os.getenv("SUBMIT_BATCH_SIZE", "100"))
+    SUBMIT_MAX_LATENCY_MS = int(os.getenv("SUBMIT_MAX_LATENCY_MS", "50"))
+    SUBMIT_QUEUE_SIZE = int(os.getenv("SUBMIT_QUEUE_SIZE", "1000"))
+    SUBMIT_PUT_TIMEOUT = float(os.getenv("SUBMIT_PUT_TIMEOUT", "5"))
+
+    # Повторы: сколько id апдейтов помнить и окно, в котором одинаковая заявка считается повтором
+    DEDUP_UPDATES_SIZE = int(os.getenv("DEDUP_UPDATES_SIZE", "10000"))
+    DEDUP_SUBMISSIONS_SIZE = int(os.getenv("DEDUP_SUBMISSIONS_SIZE", "10000"))
+    DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", "600"))
+
+    # Отправка уведомлений в группу заявок
+    NOTIFY_RATE_PER_MINUTE = int(os.getenv("NOTIFY_RATE_PER_MINUTE", "20"))
+    NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "10"))
+
+    # Режим вебхука (если WEBHOOK_URL пуст — long polling)
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_MAX_TASKS = int(os.getenv("WEBHOOK_MAX_TASKS", "100"))
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    WEBAPP_HOST = os.getenv("WEBAPP_HOST", "127.0.0.1")
+    WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+    WEBAPP_REUSE_PORT = os.getenv("WEBAPP_REUSE_PORT", "0") == "1"
+    DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "0") == "1"
+
+    # Несколько воркеров: фоновые задачи и регистрацию вебхука выполняет только один
+    RUN_BACKGROUND_JOBS = os.getenv("RUN_BACKGROUND_JOBS", "1") == "1"
+    CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "0"))
+
+    # Хранилище состояний FSM
+    FSM_TTL_SECONDS = int(os.getenv("FSM_TTL_SECONDS", "86400"))
+    FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+    FSM_FLUSH_MS = int(os.getenv("FSM_FLUSH_MS", "200"))
+    FSM_SWEEP_SECONDS = int(os.getenv("FSM_SWEEP_SECONDS", "600"))
+
+    # Статистика
+    STATS_FLUSH_SECONDS = float(os.getenv("STATS_FLUSH_SECONDS", "10"))
+
+    # Архив заявок: старше ARCHIVE_AFTER_DAYS дней — в сжатые файлы по месяцам (0 — не архивировать)
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+    ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+    ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+    ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+    # Пользователи и рассылки
+    USERS_FLUSH_SECONDS = float(os.getenv("USERS_FLUSH_SECONDS", "5"))
+    BROADCAST_RATE_PER_SECOND = float(os.getenv("BROADCAST_RATE_PER_SECOND", "25"))
+    BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+    BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "500"))
+
+    # Ограничение частоты апдейтов от одного пользователя (в минуту; 0 — без ограничения)
+    THROTTLE_START_PER_MINUTE = int(os.getenv("THROTTLE_START_PER_MINUTE", "10"))
+    THROTTLE_MENU_PER_MINUTE = int(os.getenv("THROTTLE_MENU_PER_MINUTE", "40"))
+    THROTTLE_FORM_PER_MINUTE = int(os.getenv("THROTTLE_FORM_PER_MINUTE", "30"))
+    THROTTLE_ADMIN_PER_MINUTE = int(os.getenv("THROTTLE_ADMIN_PER_MINUTE", "120"))
+    THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", "5"))
+    THROTTLE_CACHE_SIZE = int(os.getenv("THROTTLE_CACHE_SIZE", "100000"))
+    THROTTLE_WARN = os.getenv("THROTTLE_WARN", "1") == "1"
+
+    # Метрики Prometheus (0 — отдельный сервер не поднимается) и журнал медленных апдейтов
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+    SLOW_UPDATE_MS = int(os.getenv("SLOW_UPDATE_MS", "1000"))
+
+    # Несколько магазинов в одном процессе: боты, их токены и админы — в таблице tenants
+    MULTI_TENANT = os.getenv("MULTI_TENANT", "0") == "1"
+
+    def validate(self):
+        """Проверка перед запуском бота. Импорт config не падает без токена,
+        чтобы инструменты и бенчмарк могли импортировать модули бота"""
+        if not self.MULTI_TENANT and not self.BOT_TOKEN:
+            raise ValueError("BOT_TOKEN не указан в .env файле!")
+        if not self.MULTI_TENANT and not self.ADMIN_IDS:
+            raise ValueError("ADMIN_IDS не указаны в .env файле!")
 
 config = Config()
\ No newline at end of file
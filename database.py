@@ -1,104 +1,362 @@
-from sqlalchemy import create_engine, event
-from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy.pool import StaticPool
-from contextlib import contextmanager
-from models import Base
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
 from config import config
 
-# Настройка движка
-if config.DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(
-        config.DATABASE_URL,
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool
-    )
 
+# Синхронные схемы URL и их асинхронные замены. Для PostgreSQL нужен пакет asyncpg
+_ASYNC_DRIVERS = (
+    ("sqlite:", "sqlite+aiosqlite:"),
+    ("postgresql:", "postgresql+asyncpg:"),
+    ("postgresql+psycopg2:", "postgresql+asyncpg:"),
+    ("postgres:", "postgresql+asyncpg:"),
+)
 
-    # Включаем внешние ключи для SQLite
-    @event.listens_for(engine, "connect")
-    def set_sqlite_pragma(dbapi_conn, connection_record):
+
+def async_database_url(url: str) -> str:
+    """Подставляет асинхронный драйвер, если в URL указан синхронный"""
+    for prefix, replacement in _ASYNC_DRIVERS:
+        if url.startswith(prefix):
+            return replacement + url[len(prefix):]
+    return url
+
+
+def _sqlite_pragmas(*pragmas):
+    def set_pragmas(dbapi_conn, connection_record):
         cursor = dbapi_conn.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON")
+        for pragma in pragmas:
+            cursor.execute(f"PRAGMA {pragma}")
         cursor.close()
-else:
-    engine = create_engine(config.DATABASE_URL, pool_pre_ping=True)
+    return set_pragmas
 
-# Создание таблиц
-Base.metadata.create_all(bind=engine)
 
-# Фабрика сессий
-session_factory = sessionmaker(bind=engine, autocommit=False, autoflush=False)
-SessionLocal = scoped_session(session_factory)
+def _create_engines(url: str) -> Tuple[AsyncEngine, AsyncEngine]:
+    """Движки для записи и для чтения; вне файловой SQLite это один и тот же движок"""
+    if url.startswith("sqlite") and (":memory:" in url or url.endswith("://")):
+        # База в памяти живёт, пока открыто её единственное соединение
+        engine = create_async_engine(
+            url,
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool
+        )
+        event.listen(engine.sync_engine, "connect", _sqlite_pragmas("foreign_keys=ON"))
+        return engine, engine
+    if url.startswith("sqlite"):
+        # WAL: читатели не ждут пишущую транзакцию, а она — читателей.
+        # Пишет одно соединение — запись сериализуется пулом, а не блокировками
+        # SQLite; timeout — ожидание блокировки от других процессов
+        tuning = (
+            f"synchronous={config.SQLITE_SYNCHRONOUS}",
+            f"mmap_size={config.SQLITE_MMAP_SIZE}",
+            f"cache_size=-{config.SQLITE_CACHE_SIZE_KB}",
+            "foreign_keys=ON",
+        )
+        engine = create_async_engine(
+            url, connect_args={"timeout": 30}, poolclass=AsyncAdaptedQueuePool,
+            pool_size=1, max_overflow=0, pool_timeout=30
+        )
+        event.listen(engine.sync_engine, "connect", _sqlite_pragmas("journal_mode=WAL", *tuning))
+        read_engine = create_async_engine(
+            url, connect_args={"timeout": 30}, poolclass=AsyncAdaptedQueuePool,
+            pool_size=config.SQLITE_READ_POOL_SIZE, max_overflow=0
+        )
+        event.listen(read_engine.sync_engine, "connect", _sqlite_pragmas(*tuning, "query_only=ON"))
+        return engine, read_engine
+    engine = create_async_engine(url, pool_pre_ping=True)
+    return engine, engine
 
 
-@contextmanager
-def get_db():
-    """Контекстный менеджер для безопасной работы с сессией"""
-    db = SessionLocal()
+# Движки создаются при первом обращении к БД, а не при импорте: импорт модулей
+# бота (в инструментах, бенчмарке) не открывает соединений
+_engines: Optional[Tuple[AsyncEngine, AsyncEngine]] = None
+_engine_hooks: List[Callable] = []
+
+
+def _ensure_engines() -> Tuple[AsyncEngine, AsyncEngine]:
+    global _engines
+    if _engines is None:
+        _engines = _create_engines(async_database_url(config.DATABASE_URL))
+        for hook in _engine_hooks:
+            for sync_engine in _sync_engines():
+                hook(sync_engine)
+    return _engines
+
+
+def _sync_engines():
+    engine, read_engine = _engines
+    return (engine.sync_engine,) if read_engine is engine else (engine.sync_engine, read_engine.sync_engine)
+
+
+def get_engine() -> AsyncEngine:
+    """Движок для записи"""
+    return _ensure_engines()[0]
+
+
+def get_read_engine() -> AsyncEngine:
+    return _ensure_engines()[1]
+
+
+def on_engine(hook: Callable):
+    """Вызывает hook(sync_engine) для каждого движка — уже созданного и будущего.
+    Так подключаются слушатели событий (счётчики, метрики), не создавая движков заранее"""
+    _engine_hooks.append(hook)
+    if _engines is not None:
+        for sync_engine in _sync_engines():
+            hook(sync_engine)
+
+
+async def dispose_engines():
+    """Закрывает соединения; следующее обращение к БД создаст движки заново"""
+    global _engines
+    if _engines is None:
+        return
+    engine, read_engine = _engines
+    _engines = None
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+
+
+class RoutingSession(Session):
+    """Чтение идёт через движок для чтения, запись — через движок для записи.
+    Начав писать, транзакция до конца остаётся на нём, чтобы видеть свои изменения"""
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        engine, read_engine = _ensure_engines()
+        if read_engine is engine:
+            return engine.sync_engine
+        # is_select есть и у select(), и у text(...).columns(...) — сырого SQL только для чтения
+        if self.info.get("writing") or self._flushing or not getattr(clause, "is_select", False):
+            self.info["writing"] = True
+            return engine.sync_engine
+        return read_engine.sync_engine
+
+
+@event.listens_for(RoutingSession, "after_commit")
+@event.listens_for(RoutingSession, "after_rollback")
+def _stop_writing(session):
+    session.info.pop("writing", None)
+
+
+# Фабрика сессий. expire_on_commit=False: после commit атрибуты остаются доступны
+# без неявной ленивой подгрузки, которая в асинхронном режиме невозможна.
+# Движок выбирает RoutingSession.get_bind, поэтому bind не задан
+SessionLocal = async_sessionmaker(
+    sync_session_class=RoutingSession, autoflush=False, expire_on_commit=False
+)
+
+
+def upsert(table):
+    """INSERT с поддержкой on_conflict_do_update() для текущей СУБД"""
+    if get_engine().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+@dataclass
+class DbStats:
+    """Счётчики обращений к БД в рамках одного апдейта"""
+    connections: int = 0
+    queries: int = 0
+
+
+current_db_stats: ContextVar[Optional[DbStats]] = ContextVar("current_db_stats", default=None)
+
+
+def _count_checkout(dbapi_conn, connection_record, connection_proxy):
+    stats = current_db_stats.get()
+    if stats is not None:
+        stats.connections += 1
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    stats = current_db_stats.get()
+    if stats is not None:
+        stats.queries += 1
+
+
+def _count_events(sync_engine):
+    event.listen(sync_engine, "checkout", _count_checkout)
+    event.listen(sync_engine, "before_cursor_execute", _count_query)
+
+
+on_engine(_count_events)
+
+
+class LazySession:
+    """Прокси над AsyncSession: сессия создаётся при первом обращении к ней,
+    а соединение берётся из пула только при первом запросе"""
+
+    def __init__(self, factory=SessionLocal):
+        self._factory = factory
+        self._session = None
+        self._written = False
+
+    def _get(self):
+        if self._session is None:
+            self._session = self._factory()
+            sync_session = self._session.sync_session
+            event.listen(sync_session, "after_flush", self._on_flush)
+            event.listen(sync_session, "do_orm_execute", self._on_execute)
+            event.listen(sync_session, "after_commit", self._on_end)
+            event.listen(sync_session, "after_rollback", self._on_end)
+        return self._session
+
+    def _on_flush(self, session, flush_context):
+        self._written = True
+
+    def _on_execute(self, orm_execute_state):
+        # session.execute(update(...)) и сырой SQL не попадают ни в flush, ни в new/dirty.
+        # Как и в RoutingSession.get_bind, записью считается всё, кроме SELECT
+        if not orm_execute_state.is_select:
+            self._written = True
+
+    def _on_end(self, session):
+        self._written = False
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    @property
+    def has_changes(self) -> bool:
+        if self._session is None:
+            return False
+        session = self._session
+        return self._written or bool(session.new or session.dirty or session.deleted)
+
+    async def finish(self, success: bool = True):
+        """Фиксирует изменения, если они есть, и возвращает соединение в пул"""
+        if self._session is None:
+            return
+        try:
+            if success and self.has_changes:
+                await self._session.commit()
+            elif self._session.in_transaction():
+                await self._session.rollback()
+        finally:
+            await self._session.close()
+
+
+@asynccontextmanager
+async def lazy_db():
+    """Как get_db(), но без обращения к БД, пока сессия не понадобится хендлеру"""
+    stats = DbStats()
+    token = current_db_stats.set(stats)
+    session = LazySession()
     try:
-        yield db
-        db.commit()
+        yield session, stats
     except Exception:
-        db.rollback()
+        await session.finish(success=False)
         raise
+    else:
+        await session.finish()
     finally:
-        db.close()
-
-
-def init_db():
-    """Инициализация начальных данных"""
-    from models import BotSettings, AdminSettings, Button
-
-    with get_db() as db:
-        # Настройки бота
-        if not db.query(BotSettings).first():
-            db.add(BotSettings(
-                greeting_text="👋 Добро пожаловать! Выберите, что вас интересует:",
-                greeting_photo=None
-            ))
-
-        # Админ-настройки
-        if not db.query(AdminSettings).first():
-            db.add(AdminSettings(
-                requests_chat_id=config.REQUESTS_CHAT_ID,
-                requests_template=(
-                    "📋 НОВАЯ ЗАЯВКА\n"
-                    "Имя: {answers[0]}\n"
-                    "Задача: {answers[1]}\n"
-                    "Контакт: {answers[2]}\n"
-                    "Время: {time}\n"
-                    "Пользователь: @{username} (ID: {user_id})"
-                )
-            ))
-
-        # Кнопки по умолчанию
-        if not db.query(Button).first():
-            db.add(Button(
+        current_db_stats.reset(token)
+
+
+@asynccontextmanager
+async def get_db():
+    """Контекстный менеджер для безопасной работы с сессией"""
+    async with SessionLocal() as db:
+        try:
+            yield db
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+
+async def init_db():
+    """Доводит схему до последней версии и заполняет начальные данные.
+
+    Если схема уже актуальна, это один короткий запрос: начальные данные
+    пишутся только вместе с миграциями (новому магазину — в tenants.py add)"""
+    from stats import backfill_totals
+    from tenants import load_tenants, tenant_registry
+
+    from migrations import upgrade
+
+    async with get_engine().begin() as conn:
+        if await conn.run_sync(upgrade):
+            # Та же транзакция, что и у миграций: версия схемы не запишется без начальных данных
+            db = AsyncSession(bind=conn, autoflush=False, expire_on_commit=False)
+            for tenant in await load_tenants(db):
+                await seed_tenant(db, tenant.id)
+            # Счётчики статистики для заявок, сохранённых до её появления
+            await backfill_totals(db)
+            await db.flush()
+
+    async with get_db() as db:
+        tenant_registry.set_tenants(await load_tenants(db))
+
+
+async def seed_tenant(db, tenant_id: int):
+    """Настройки и кнопки по умолчанию для магазина, у которого их ещё нет"""
+    from models import BotSettings, AdminSettings, Button, DEFAULT_TENANT_ID
+
+    # Настройки бота
+    if not await db.scalar(select(BotSettings).where(BotSettings.tenant_id == tenant_id).limit(1)):
+        db.add(BotSettings(
+            tenant_id=tenant_id,
+            greeting_text="👋 Добро пожаловать! Выберите, что вас интересует:",
+            greeting_photo=None
+        ))
+
+    # Админ-настройки
+    if not await db.scalar(select(AdminSettings).where(AdminSettings.tenant_id == tenant_id).limit(1)):
+        db.add(AdminSettings(
+            tenant_id=tenant_id,
+            requests_chat_id=config.REQUESTS_CHAT_ID if tenant_id == DEFAULT_TENANT_ID else None,
+            requests_template=(
+                "📋 НОВАЯ ЗАЯВКА\n"
+                "Имя: {answers[0]}\n"
+                "Задача: {answers[1]}\n"
+                "Контакт: {answers[2]}\n"
+                "Время: {time}\n"
+                "Пользователь: @{username} (ID: {user_id})"
+            )
+        ))
+
+    # Кнопки по умолчанию
+    if not await db.scalar(select(Button).where(Button.tenant_id == tenant_id).limit(1)):
+        db.add_all([
+            Button(
+                tenant_id=tenant_id,
                 text="Узнать цены",
                 order=1,
                 is_active=True,
                 response_type="text",
                 response_content="Цены от 5000 руб. Подробнее на сайте: https://example.com/prices"
-            ))
-            db.add(Button(
+            ),
+            Button(
+                tenant_id=tenant_id,
                 text="Заказать",
                 order=2,
                 is_active=True,
                 response_type="form",
                 form_questions='["Как вас зовут?", "Что нужно сделать?", "Оставьте контакт (телефон или email)"]'
-            ))
-            db.add(Button(
+            ),
+            Button(
+                tenant_id=tenant_id,
                 text="Контакты",
                 order=3,
                 is_active=True,
                 response_type="text",
                 response_content="📞 +7 (999) 123-45-67\n📧 info@example.com\n🌐 https://example.com"
-            ))
-            db.add(Button(
+            ),
+            Button(
+                tenant_id=tenant_id,
                 text="FAQ",
                 order=4,
                 is_active=True,
                 response_type="text",
                 response_content="❓ Частые вопросы:\n— Сроки: от 3 дней\n— Предоплата: 50%\n— Гарантия: 30 дней"
-            ))
-        db.commit()
\ No newline at end of file
+            ),
+        ])
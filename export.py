@@ -0,0 +1,225 @@
+"""Выгрузка заявок в сжатый CSV или JSONL.
+
+Заявки читаются потоком (server-side cursor, yield_per) и пишутся в gzip-файл
+порциями в отдельном потоке: память не растёт с числом заявок, а event loop
+не блокируется сжатием и записью на диск.
+"""
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import re
+from collections import namedtuple
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+
+from archive import month_path, read_month
+from database import SessionLocal
+from forms import decode_answers, question_texts
+from models import Button, FormResponse
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "jsonl")
+CHUNK_ROWS = 1000
+# Ограничение Bot API на отправку документа
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+_DATE_FORMAT = "%d.%m.%Y"
+_CALLBACK_DATE = "%Y%m%d"
+
+# Одна выгрузка за раз: несколько параллельных только нагружают БД
+export_lock = asyncio.Lock()
+
+# С этих символов Excel начинает формулу; телефон вида +7 999 123-45-67 оставляем как есть
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+_PHONE_CELL = re.compile(r"\+[\d\s\-()]+")
+
+
+@dataclass(frozen=True)
+class ExportFilter:
+    button_id: Optional[int] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None  # включительно
+    fmt: str = "csv"
+
+    def pack(self) -> str:
+        """Компактная запись для callback_data: <кнопка>:<с>:<по>:<формат>"""
+        def pack_date(value):
+            return value.strftime(_CALLBACK_DATE) if value else "-"
+        return f"{self.button_id or 0}:{pack_date(self.date_from)}:{pack_date(self.date_to)}:{self.fmt}"
+
+    @classmethod
+    def unpack(cls, packed: str) -> "ExportFilter":
+        def unpack_date(value):
+            return datetime.strptime(value, _CALLBACK_DATE).date() if value != "-" else None
+        button_id, date_from, date_to, fmt = packed.split(":")
+        if fmt not in FORMATS:
+            raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+        return cls(int(button_id) or None, unpack_date(date_from), unpack_date(date_to), fmt)
+
+    def filename(self) -> str:
+        parts = ["applications"]
+        if self.button_id:
+            parts.append(f"button{self.button_id}")
+        if self.date_from or self.date_to:
+            parts.append(f"{self.date_from or ''}_{self.date_to or ''}")
+        return "_".join(parts) + f".{self.fmt}.gz"
+
+    def describe(self) -> str:
+        if self.date_from and self.date_to:
+            period = f"{self.date_from.strftime(_DATE_FORMAT)}–{self.date_to.strftime(_DATE_FORMAT)}"
+        elif self.date_from:
+            period = f"с {self.date_from.strftime(_DATE_FORMAT)}"
+        elif self.date_to:
+            period = f"по {self.date_to.strftime(_DATE_FORMAT)}"
+        else:
+            period = "всё время"
+        return f"период: {period}, формат: {self.fmt.upper()}"
+
+
+def last_days(days: int, today: Optional[date] = None) -> Tuple[Optional[date], Optional[date]]:
+    """Период из последних days дней, включая сегодня; 0 — без ограничения"""
+    if not days:
+        return None, None
+    today = today or date.today()
+    return today - timedelta(days=days - 1), today
+
+
+def parse_date_range(text: str) -> Tuple[date, date]:
+    """'01.09.2026-30.09.2026' или один день '01.09.2026'"""
+    parts = [part.strip() for part in text.replace("—", "-").replace("–", "-").split("-")]
+    if len(parts) not in (1, 2):
+        raise ValueError(text)
+    date_from = datetime.strptime(parts[0], _DATE_FORMAT).date()
+    date_to = datetime.strptime(parts[-1], _DATE_FORMAT).date()
+    if date_to < date_from:
+        raise ValueError(text)
+    return date_from, date_to
+
+
+def build_query(flt: ExportFilter, tenant_id: int):
+    stmt = (
+        select(
+            FormResponse.id, FormResponse.submitted_at, FormResponse.created_at,
+            FormResponse.user_id, FormResponse.button_id, Button.text, FormResponse.answers,
+        )
+        .outerjoin(Button, Button.id == FormResponse.button_id)
+        .where(FormResponse.tenant_id == tenant_id)
+        .order_by(FormResponse.id)
+    )
+    if flt.button_id:
+        stmt = stmt.where(FormResponse.button_id == flt.button_id)
+    # У заявок без submitted_at даты нет — в выгрузку за период они не попадают
+    if flt.date_from:
+        stmt = stmt.where(FormResponse.submitted_at >= datetime.combine(flt.date_from, time.min))
+    if flt.date_to:
+        stmt = stmt.where(FormResponse.submitted_at < datetime.combine(flt.date_to + timedelta(days=1), time.min))
+    return stmt
+
+
+def _csv_cell(value):
+    """Текст от пользователя для CSV: Excel не выполнит его как формулу (=HYPERLINK(...))"""
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES) and not _PHONE_CELL.fullmatch(value):
+        return "'" + value
+    return value
+
+
+class _Writer:
+    """Пишет порции строк в gzip-файл. Все методы вызываются в отдельном потоке"""
+
+    def __init__(self, path: str, fmt: str, answer_columns: Sequence[str]):
+        self.fmt = fmt
+        if fmt == "csv":
+            # BOM нужен, чтобы Excel правильно открыл кириллицу
+            self._file = gzip.open(path, "wt", encoding="utf-8-sig", newline="")
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(["№", "Дата", "Время", "ID пользователя", "ID кнопки", "Кнопка",
+                                *map(_csv_cell, answer_columns)])
+        else:
+            self._file = gzip.open(path, "wt", encoding="utf-8")
+
+    def write(self, rows):
+        if self.fmt == "csv":
+            self._csv.writerows(
+                [row.id, row.submitted_at.isoformat(sep=" ", timespec="seconds") if row.submitted_at else "",
+                 row.created_at, row.user_id, row.button_id, _csv_cell(row.text or ""),
+                 *map(_csv_cell, decode_answers(row.answers))]
+                for row in rows
+            )
+        else:
+            self._file.writelines(
+                json.dumps({
+                    "id": row.id,
+                    "submitted_at": row.submitted_at.isoformat() if row.submitted_at else None,
+                    "time": row.created_at,
+                    "user_id": row.user_id,
+                    "button_id": row.button_id,
+                    "button": row.text,
+                    "answers": decode_answers(row.answers),
+                }, ensure_ascii=False) + "\n"
+                for row in rows
+            )
+
+    def close(self):
+        self._file.close()
+
+
+async def _answer_columns(session, flt: ExportFilter, tenant_id: int) -> List[str]:
+    """Заголовки ответов: вопросы кнопки, а для всех кнопок — 'Ответ 1..N'"""
+    stmt = select(Button.form_questions).where(Button.tenant_id == tenant_id, Button.response_type == "form")
+    if flt.button_id:
+        stmt = select(Button.form_questions).where(Button.tenant_id == tenant_id, Button.id == flt.button_id)
+    lists = [question_texts(raw) for raw in (await session.scalars(stmt))]
+    if flt.button_id and lists:
+        return lists[0]
+    width = max((len(questions) for questions in lists), default=0)
+    return [f"Ответ {i}" for i in range(1, width + 1)]
+
+
+async def export_responses(flt: ExportFilter, path: str, tenant_id: int) -> int:
+    """Пишет заявки магазина по фильтру в path и возвращает их число"""
+    async with SessionLocal() as session:
+        columns = await _answer_columns(session, flt, tenant_id)
+        writer = await asyncio.to_thread(_Writer, path, flt.fmt, columns)
+        count = 0
+        try:
+            result = await session.stream(build_query(flt, tenant_id).execution_options(yield_per=CHUNK_ROWS))
+            async for rows in result.partitions():
+                await asyncio.to_thread(writer.write, rows)
+                count += len(rows)
+        finally:
+            await asyncio.to_thread(writer.close)
+    logger.info(f"Выгружено заявок магазина {tenant_id}: {count} ({flt.describe()})")
+    return count
+
+
+# Строка архива в том же виде, что и строка build_query
+_ArchivedRow = namedtuple("_ArchivedRow", "id submitted_at created_at user_id button_id text answers")
+
+
+async def export_archive(tenant_id: int, month: str, fmt: str, path: str) -> int:
+    """Выгружает архивный месяц магазина (см. archive.py) в path и возвращает число заявок"""
+    records = await asyncio.to_thread(read_month, month_path(tenant_id, month))
+    async with SessionLocal() as session:
+        columns = await _answer_columns(session, ExportFilter(fmt=fmt), tenant_id)
+        button_names = dict((await session.execute(
+            select(Button.id, Button.text).where(Button.tenant_id == tenant_id)
+        )).all())
+    rows = [
+        _ArchivedRow(record["id"], record["submitted_at"], record["created_at"], record["user_id"],
+                     record["button_id"], button_names.get(record["button_id"]), record["answers"])
+        for record in records
+    ]
+    writer = await asyncio.to_thread(_Writer, path, fmt, columns)
+    try:
+        for start in range(0, len(rows), CHUNK_ROWS):
+            await asyncio.to_thread(writer.write, rows[start:start + CHUNK_ROWS])
+    finally:
+        await asyncio.to_thread(writer.close)
+    logger.info(f"Выгружен архив магазина {tenant_id} за {month}: {len(rows)} заявок")
+    return len(rows)
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import os
+import re
+from collections import defaultdict
+from typing import Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, FSInputFile
+from sqlalchemy import update
+
+from catalog import ButtonEntry, get_catalog, reload_catalog
+from models import Button
+
+logger = logging.getLogger(__name__)
+
+# file_id Telegram состоит из [A-Za-z0-9_-]; точка или слэш означают путь к файлу
+_PATH_CHARS = re.compile(r"[./\\]")
+
+_upload_locks = defaultdict(asyncio.Lock)
+
+
+def is_local_path(content: str) -> bool:
+    return bool(_PATH_CHARS.search(content))
+
+
+def file_signature(path: str) -> Optional[Tuple[float, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def _cached_id(button: ButtonEntry, signature: Tuple[float, int]) -> Optional[str]:
+    if button.cached_file_id and (button.cached_file_mtime, button.cached_file_size) == signature:
+        return button.cached_file_id
+    return None
+
+
+async def send_button_file(message: Message, session, button: ButtonEntry, tenant_id: int):
+    """Отправляет файл кнопки. Локальный файл загружается в Telegram один раз,
+    дальше он уходит по file_id, пока не изменятся его время модификации или размер"""
+    content = button.response_content
+    if not content:
+        await message.answer("Файл не найден.")
+        return
+    if not is_local_path(content):
+        # Документ, присланный админом: в response_content уже лежит file_id
+        await message.answer_document(document=content)
+        return
+
+    signature = file_signature(content)
+    if signature is None:
+        await message.answer("Файл не найден.")
+        return
+
+    file_id = _cached_id(button, signature)
+    if file_id:
+        try:
+            await message.answer_document(document=file_id)
+            return
+        except TelegramBadRequest as e:
+            logger.warning(f"Кэшированный file_id кнопки {button.id} не принят, загружаем заново: {e}")
+
+    # Одновременные нажатия не должны загружать один и тот же файл несколько раз
+    async with _upload_locks[button.id]:
+        fresh = get_catalog(tenant_id).buttons.get(button.text)
+        file_id = _cached_id(fresh, signature) if fresh and fresh.id == button.id else None
+        if file_id and file_id != button.cached_file_id:
+            await message.answer_document(document=file_id)
+            return
+        sent = await message.answer_document(document=FSInputFile(content))
+        await session.execute(update(Button).where(Button.id == button.id).values(
+            cached_file_id=sent.document.file_id,
+            cached_file_mtime=signature[0],
+            cached_file_size=signature[1],
+        ))
+        await session.commit()
+        await reload_catalog(session, tenant_id)
+        logger.info(f"Файл {content} загружен, file_id сохранён для кнопки {button.id}")
@@ -0,0 +1,231 @@
+"""Анкеты кнопок типа form.
+
+Описание анкеты хранится в Button.form_questions как JSON-массив шагов.
+Шаг — строка с вопросом или объект:
+
+    {"id": "contact", "text": "Оставьте контакт", "validate": "phone_or_email"}
+    {"text": "Нужна доставка?", "options": ["Да", "Нет"], "next": {"Нет": "end"}}
+    {"text": "Артикул?", "validate": "regex", "pattern": "[A-Z]{2}\\\\d{4}", "error": "Формат: AB1234"}
+
+validate: phone, email, phone_or_email, number, regex (с pattern).
+next: id шага, "end" или словарь {ответ: id шага}, где "*" — вариант по умолчанию;
+без next анкета идёт к следующему шагу.
+
+Описание компилируется один раз при загрузке каталога; в состоянии FSM
+пользователя лежат только id анкеты, номер шага и ответы.
+"""
+import json
+import re
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable, List, Mapping, Optional, Tuple
+
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
+
+END = -1
+DEFAULT_QUESTIONS = ("Ваше имя?",)
+MAX_ANSWER_LENGTH = 1000
+
+_PHONE = re.compile(r"\+?[\d\s\-()]{7,20}")
+_EMAIL = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+_NUMBER = re.compile(r"-?\d+(?:[.,]\d+)?")
+
+
+class FormError(ValueError):
+    """Описание анкеты не удалось скомпилировать"""
+
+
+def _is_phone(value: str) -> bool:
+    return bool(_PHONE.fullmatch(value)) and 7 <= sum(ch.isdigit() for ch in value) <= 15
+
+
+def _is_email(value: str) -> bool:
+    return bool(_EMAIL.fullmatch(value))
+
+
+VALIDATORS = {
+    "phone": (_is_phone, "Введите номер телефона, например +7 999 123-45-67"),
+    "email": (_is_email, "Введите e-mail, например name@example.com"),
+    "phone_or_email": (lambda v: _is_phone(v) or _is_email(v), "Оставьте телефон или e-mail"),
+    "number": (lambda v: bool(_NUMBER.fullmatch(v)), "Введите число"),
+}
+
+
+@dataclass(frozen=True)
+class Step:
+    key: str
+    text: str
+    check: Optional[Callable[[str], bool]]
+    error: str
+    options: Tuple[str, ...]
+    keyboard: Optional[ReplyKeyboardMarkup]
+    branches: Mapping[str, int]  # ответ в нижнем регистре -> номер шага
+    next: int  # номер следующего шага по умолчанию или END
+
+    def validate(self, answer: str) -> Optional[str]:
+        """Нормализованный ответ или None, если ответ не подходит"""
+        answer = answer.strip()
+        if not answer or len(answer) > MAX_ANSWER_LENGTH:
+            return None
+        if self.options:
+            for option in self.options:
+                if option.lower() == answer.lower():
+                    return option
+            return None
+        if self.check is not None and not self.check(answer):
+            return None
+        return answer
+
+    def next_step(self, answer: str) -> int:
+        return self.branches.get(answer.lower(), self.next)
+
+
+@dataclass(frozen=True)
+class Form:
+    steps: Tuple[Step, ...]
+
+    @property
+    def questions(self) -> Tuple[str, ...]:
+        return tuple(step.text for step in self.steps)
+
+
+def _step_definition(item, index: int) -> dict:
+    if isinstance(item, str):
+        return {"text": item}
+    if isinstance(item, dict) and isinstance(item.get("text"), str):
+        return item
+    raise FormError(f"Шаг {index + 1}: нужен текст вопроса или объект с полем text")
+
+
+def _expect_str(definition: dict, field: str, index: int):
+    """Поле шага, если задано, должно быть строкой — иначе FormError, а не TypeError"""
+    if definition.get(field) is not None and not isinstance(definition[field], str):
+        raise FormError(f"Шаг {index + 1}: поле {field} должно быть строкой")
+
+
+def compile_form(raw) -> Form:
+    """Компилирует описание анкеты (JSON-строку или уже разобранный список)"""
+    try:
+        items = json.loads(raw) if isinstance(raw, str) else raw
+    except ValueError as e:
+        raise FormError(f"Неверный JSON: {e}")
+    if not items:
+        items = list(DEFAULT_QUESTIONS)
+    if not isinstance(items, list):
+        raise FormError("Анкета должна быть JSON-массивом")
+
+    definitions = [_step_definition(item, i) for i, item in enumerate(items)]
+    keys = [str(d.get("id", i + 1)) for i, d in enumerate(definitions)]
+    if len(set(keys)) != len(keys):
+        raise FormError("У шагов повторяются id")
+    index_of = {key: i for i, key in enumerate(keys)}
+
+    def target(name, at: int) -> int:
+        if name == "end":
+            return END
+        if str(name) not in index_of:
+            raise FormError(f"Шаг {at + 1}: нет шага с id {name!r}")
+        return index_of[str(name)]
+
+    steps = []
+    for i, d in enumerate(definitions):
+        kind = d.get("validate")
+        check = None
+        error = d.get("error")
+        _expect_str(d, "validate", i)
+        _expect_str(d, "error", i)
+        if kind == "regex":
+            _expect_str(d, "pattern", i)
+            try:
+                pattern = re.compile(d.get("pattern") or "")
+            except re.error as e:
+                raise FormError(f"Шаг {i + 1}: неверное регулярное выражение: {e}")
+            check = lambda value, pattern=pattern: bool(pattern.fullmatch(value))
+            error = error or "Ответ не подходит, попробуйте ещё раз"
+        elif kind is not None:
+            if kind not in VALIDATORS:
+                raise FormError(f"Шаг {i + 1}: неизвестная проверка {kind!r}")
+            check, default_error = VALIDATORS[kind]
+            error = error or default_error
+
+        options = d.get("options") or ()
+        if not isinstance(options, (list, tuple)) or not all(isinstance(option, str) for option in options):
+            raise FormError(f"Шаг {i + 1}: options должен быть списком строк")
+        options = tuple(options)
+        if options:
+            error = error or "Выберите один из вариантов на клавиатуре"
+        keyboard = ReplyKeyboardMarkup(
+            keyboard=[[KeyboardButton(text=option)] for option in options],
+            resize_keyboard=True, one_time_keyboard=True,
+        ) if options else None
+
+        default_next = i + 1 if i + 1 < len(definitions) else END
+        branches = {}
+        next_spec = d.get("next")
+        if isinstance(next_spec, dict):
+            for answer, name in next_spec.items():
+                if answer == "*":
+                    default_next = target(name, i)
+                else:
+                    branches[str(answer).lower()] = target(name, i)
+        elif next_spec is not None:
+            default_next = target(next_spec, i)
+
+        steps.append(Step(
+            key=keys[i],
+            text=d["text"],
+            check=check,
+            error=error or "Ответ не подходит, попробуйте ещё раз",
+            options=options,
+            keyboard=keyboard,
+            branches=MappingProxyType(branches),
+            next=default_next,
+        ))
+    return Form(steps=tuple(steps))
+
+
+def question_texts(raw) -> List[str]:
+    """Тексты вопросов из описания анкеты — для заголовков выгрузки"""
+    try:
+        return list(compile_form(raw).questions)
+    except FormError:
+        return []
+
+
+def decode_answers(raw: str) -> list:
+    """Ответы заявки из FormResponse.answers; не-JSON — один ответ как есть"""
+    try:
+        answers = json.loads(raw)
+    except (TypeError, ValueError):
+        return [raw]
+    return answers if isinstance(answers, list) else [answers]
+
+
+@dataclass
+class FormProgress:
+    """Всё, что хранится в FSM пользователя на время анкеты"""
+    form_id: int
+    step: int
+    answers: List[Optional[str]]
+
+    def to_state(self) -> dict:
+        return {"f": self.form_id, "s": self.step, "a": self.answers}
+
+    @classmethod
+    def from_state(cls, data: dict) -> Optional["FormProgress"]:
+        if "f" in data:
+            return cls(data["f"], data["s"], list(data["a"]))
+        # Состояние, сохранённое до компилируемых анкет
+        if "form_button_id" in data:
+            answers = list(data.get("answers", []))
+            return cls(data["form_button_id"], len(answers), answers)
+        return None
+
+    def record(self, form: Form, answer: str) -> int:
+        """Сохраняет ответ на текущий шаг и возвращает следующий шаг (или END).
+        Ответы лежат по номерам шагов; пропущенные ветвлением шаги — None"""
+        step = form.steps[self.step]
+        self.answers.extend([None] * (self.step + 1 - len(self.answers)))
+        self.answers[self.step] = answer
+        self.step = step.next_step(answer)
+        return self.step
@@ -0,0 +1,94 @@
+"""Защита от повторной обработки.
+
+Telegram повторно доставляет апдейт, если вебхук не ответил вовремя, а
+пользователь может дважды отправить последний ответ анкеты. Поэтому:
+
+- id недавних апдейтов каждого бота хранятся в ограниченном наборе, и
+  повтор отбрасывается до хендлеров — без сессии БД и запросов к API;
+- у заявки есть ключ — хеш магазина, пользователя, кнопки и ответов вместе
+  с временным окном. Повтор в пределах окна отсекается в памяти ещё до
+  очереди записи, а уникальный индекс по ключу не даёт записать его из
+  другого процесса или после перезапуска: SubmissionQueue отбрасывает заявку,
+  если ключ её интервала или предыдущего уже записан не раньше чем window назад.
+"""
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Sequence, Tuple
+
+from config import config
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+duplicates_total = registry.counter("bot_duplicates_total", "Отброшенные повторы", ["kind"])
+
+
+def submission_key(tenant_id: int, user_id: int, button_id: int, answers: Sequence, bucket: float) -> str:
+    """Ключ заявки для уникального индекса: одинаков у одинаковых заявок из одного интервала"""
+    payload = json.dumps([tenant_id, user_id, button_id, list(answers), bucket], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def submission_keys(tenant_id: int, user_id: int, button_id: int, answers: Sequence,
+                    submitted_at: datetime, window: float) -> Tuple[str, str]:
+    """Ключ заявки в её интервале длиной window и ключ той же заявки в предыдущем.
+    Повтор не дальше window по времени лежит в одном из двух интервалов, поэтому
+    проверяются оба ключа, а граница интервалов повтор не пропускает"""
+    bucket = submitted_at.timestamp() // window if window > 0 else submitted_at.timestamp()
+    return (submission_key(tenant_id, user_id, button_id, answers, bucket),
+            submission_key(tenant_id, user_id, button_id, answers, bucket - 1))
+
+
+class RecentSet:
+    """Ограниченный набор недавних ключей с временем добавления (LRU)"""
+
+    def __init__(self, size: int, ttl: Optional[float] = None):
+        self.size = size
+        self.ttl = ttl
+        self._items: "OrderedDict[object, float]" = OrderedDict()
+
+    def add(self, key) -> bool:
+        """Запоминает ключ; False — если он уже был (и не устарел)"""
+        now = time.monotonic()
+        seen = self._items.get(key)
+        if seen is not None and (self.ttl is None or now - seen < self.ttl):
+            self._items.move_to_end(key)
+            return False
+        self._items[key] = now
+        self._items.move_to_end(key)
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
+        return True
+
+    def discard(self, key):
+        self._items.pop(key, None)
+
+    def __len__(self):
+        return len(self._items)
+
+
+recent_updates = RecentSet(config.DEDUP_UPDATES_SIZE)
+recent_submissions = RecentSet(config.DEDUP_SUBMISSIONS_SIZE, ttl=config.DEDUP_WINDOW_SECONDS)
+
+
+def submission_fingerprint(tenant_id: int, user_id: int, button_id: int, answers: Sequence) -> Tuple:
+    return tenant_id, user_id, button_id, json.dumps(list(answers), ensure_ascii=False)
+
+
+async def update_dedup_middleware(handler, event, data):
+    """Внешний middleware на dp.update: повторно доставленный апдейт пропускается.
+    Если обработка упала, id забывается — повторная доставка обработается заново"""
+    key = (data["bot"].id, event.update_id)
+    if not recent_updates.add(key):
+        duplicates_total.inc("update")
+        logger.info(f"Повтор апдейта {event.update_id} пропущен")
+        return None
+    try:
+        return await handler(event, data)
+    except Exception:
+        recent_updates.discard(key)
+        raise
@@ -0,0 +1,241 @@
+"""Метрики бота в текстовом формате Prometheus.
+
+Собираются: время и ошибки хендлеров, типы апдейтов, переходы FSM,
+SQL-запросы (через события движка) и запросы к Bot API. Медленные апдейты
+пишутся в лог вместе с разбивкой по SQL-запросам.
+"""
+import logging
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Dict, Optional, Sequence, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+from sqlalchemy import event
+
+from config import config
+from database import on_engine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = defaultdict(float)
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[tuple(labels)] += amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(tuple(labels), 0.0)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value:g}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # На каждый набор меток: счётчики по корзинам, сумма, количество
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%g"' % bound
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {count}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total:g}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+updates_total = registry.counter("bot_updates_total", "Полученные апдейты по типам", ["type"])
+handler_seconds = registry.histogram("bot_handler_duration_seconds", "Время обработки апдейта хендлером", ["handler"])
+handler_errors = registry.counter("bot_handler_errors_total", "Исключения в хендлерах", ["handler"])
+fsm_transitions = registry.counter("bot_fsm_transitions_total", "Переходы состояний FSM", ["from_state", "to_state"])
+sql_seconds = registry.histogram("bot_sql_duration_seconds", "Время SQL-запросов", ["operation"])
+sql_errors = registry.counter("bot_sql_errors_total", "Ошибки SQL-запросов", ["operation"])
+api_seconds = registry.histogram("bot_api_request_duration_seconds", "Время запросов к Bot API", ["method"])
+api_errors = registry.counter("bot_api_errors_total", "Ошибки запросов к Bot API", ["method"])
+
+
+# --- SQL ---
+
+# Разбивка SQL текущего апдейта для журнала медленных апдейтов: текст -> [число, время]
+current_sql_trace: ContextVar[Optional[dict]] = ContextVar("current_sql_trace", default=None)
+
+
+def _operation(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "?"
+
+
+def _sql_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+def _sql_finished(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+    sql_seconds.observe(elapsed, _operation(statement))
+    trace = current_sql_trace.get()
+    if trace is not None:
+        item = trace.setdefault(" ".join(statement.split())[:120], [0, 0.0])
+        item[0] += 1
+        item[1] += elapsed
+
+
+def _sql_failed(context):
+    started = context.connection.info.get("metrics_started") if context.connection is not None else None
+    if started:
+        started.pop()
+    sql_errors.inc(_operation(context.statement or ""))
+
+
+def _instrument_engine(sync_engine):
+    event.listen(sync_engine, "before_cursor_execute", _sql_started)
+    event.listen(sync_engine, "after_cursor_execute", _sql_finished)
+    event.listen(sync_engine, "handle_error", _sql_failed)
+
+
+on_engine(_instrument_engine)
+
+
+# --- Хендлеры ---
+
+async def count_update(handler, event, data):
+    """Внешний middleware на dp.update: считает апдейты по типам"""
+    updates_total.inc(event.event_type)
+    return await handler(event, data)
+
+
+async def metrics_middleware(handler, event, data):
+    """Внутренний middleware роутеров: время, ошибки, переходы FSM, медленные апдейты"""
+    handler_object = data.get("handler")
+    name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+    state_before = data.get("raw_state")
+    trace = {}
+    token = current_sql_trace.set(trace)
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    except Exception:
+        handler_errors.inc(name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        current_sql_trace.reset(token)
+        handler_seconds.observe(elapsed, name)
+        state = data.get("state")
+        if state is not None:
+            state_after = await state.get_state()
+            if state_after != state_before:
+                fsm_transitions.inc(state_before or "-", state_after or "-")
+        if config.SLOW_UPDATE_MS and elapsed * 1000 >= config.SLOW_UPDATE_MS:
+            _log_slow(name, elapsed, trace)
+
+
+def _log_slow(name: str, elapsed: float, trace: dict):
+    queries = sum(count for count, _ in trace.values())
+    sql_time = sum(duration for _, duration in trace.values())
+    lines = [f"Медленный апдейт: {name} {elapsed * 1000:.1f} мс, SQL: {queries} запросов / {sql_time * 1000:.1f} мс"]
+    for statement, (count, duration) in sorted(trace.items(), key=lambda kv: -kv[1][1])[:10]:
+        lines.append(f"  {count}× {duration * 1000:.1f} мс  {statement}")
+    logger.warning("\n".join(lines))
+
+
+# --- Bot API ---
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            api_errors.inc(name)
+            raise
+        finally:
+            api_seconds.observe(time.perf_counter() - started, name)
+
+
+def instrument_bot(bot):
+    """Подключает замер запросов к Bot API (повторный вызов ничего не делает)"""
+    if any(isinstance(m, ApiMetricsMiddleware) for m in bot.session.middleware):
+        return
+    bot.session.middleware(ApiMetricsMiddleware())
+
+
+# --- HTTP ---
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
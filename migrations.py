@@ -0,0 +1,171 @@
+"""Версионные миграции схемы БД.
+
+Текущая версия хранится в таблице schema_version. Новая база создаётся сразу
+по моделям и помечается последней версией; существующая догоняется по шагам.
+Каждая миграция должна быть идемпотентной: базовый шаг (create_all) создаёт
+новые таблицы сразу в актуальном виде, вместе с их индексами.
+"""
+import logging
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import (
+    Boolean, Column, DateTime, Index, Integer, MetaData, String, Table, false, func, inspect, insert, literal,
+    select, text, update,
+)
+
+from models import ArchivedMonth, Base, Button, FormResponse, Tenant, User
+from search import create_search_index, rebuild_search_index
+
+logger = logging.getLogger(__name__)
+
+_meta = MetaData()
+schema_version = Table("schema_version", _meta, Column("version", Integer, nullable=False))
+
+# Индексы, которых уже нет в моделях, но которые создавали прежние миграции
+_legacy_meta = MetaData()
+_legacy_buttons = Table("buttons", _legacy_meta, Column("text", String(64)), Column("is_active", Boolean))
+_legacy_button_text = Index("ux_buttons_active_text", _legacy_buttons.c.text, unique=True,
+                            sqlite_where=text("is_active = 1"), postgresql_where=text("is_active"))
+
+MIGRATIONS: List[Tuple[int, str, Callable]] = []
+
+
+def migration(version: int, description: str):
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return decorator
+
+
+def head() -> int:
+    return max(version for version, _, _ in MIGRATIONS)
+
+
+def add_missing_columns(conn):
+    """create_all не меняет существующие таблицы — досоздаём появившиеся колонки"""
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=conn.dialect)
+                default = f" DEFAULT {column.server_default.arg.text}" if column.server_default is not None else ""
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}"))
+
+
+def create_index(conn, table, name: str):
+    index = next(index for index in table.__table__.indexes if index.name == name)
+    index.create(conn, checkfirst=True)
+
+
+@migration(1, "таблицы и колонки, появившиеся до введения миграций")
+def _baseline(conn):
+    Base.metadata.create_all(conn)
+    add_missing_columns(conn)
+
+
+@migration(2, "индексы для поиска кнопок и отчётов по заявкам")
+def _indexes(conn):
+    # Уникальный индекс не создастся при дублях: оставляем первую по порядку
+    # кнопку — ту же, что и раньше отвечала пользователю
+    seen = set()
+    duplicates = []
+    rows = conn.execute(
+        select(Button.id, Button.text).where(Button.is_active == True).order_by(Button.order, Button.id)
+    )
+    for button_id, button_text in rows:
+        if button_text in seen:
+            duplicates.append(button_id)
+        seen.add(button_text)
+    if duplicates:
+        conn.execute(update(Button).where(Button.id.in_(duplicates)).values(is_active=False))
+        logger.warning(f"Отключены кнопки с повторяющимся текстом: {duplicates}")
+
+    _legacy_button_text.create(conn, checkfirst=True)
+    create_index(conn, FormResponse, "ix_form_responses_button_time")
+    create_index(conn, FormResponse, "ix_form_responses_user_time")
+
+
+@migration(3, "пользователи и рассылки")
+def _users(conn):
+    Base.metadata.create_all(conn, tables=[User.__table__, Base.metadata.tables["broadcasts"]])
+    # Тех, кто уже оставлял заявки, берём из заявок: им тоже можно написать
+    now = literal(datetime.now(), DateTime)
+    first_seen = func.coalesce(func.min(FormResponse.submitted_at), now)
+    last_seen = func.coalesce(func.max(FormResponse.submitted_at), now)
+    known = select(User.id)
+    conn.execute(insert(User).from_select(
+        ["id", "first_seen", "last_seen", "is_blocked"],
+        select(FormResponse.user_id, first_seen, last_seen, false())
+        .where(FormResponse.user_id.not_in(known))
+        .group_by(FormResponse.user_id),
+    ))
+
+
+@migration(4, "несколько магазинов: таблица tenants и tenant_id у данных магазина")
+def _tenants(conn):
+    Base.metadata.create_all(conn, tables=[Tenant.__table__])
+    # Всё, что было до этой версии, принадлежит магазину DEFAULT_TENANT_ID
+    add_missing_columns(conn)
+    _legacy_button_text.drop(conn, checkfirst=True)
+    create_index(conn, Button, "ux_buttons_tenant_active_text")
+    create_index(conn, FormResponse, "ix_form_responses_tenant_time")
+
+
+@migration(5, "полнотекстовый индекс заявок")
+def _search(conn):
+    create_search_index(conn)
+    rebuild_search_index(conn)
+
+
+@migration(6, "архив заявок по месяцам")
+def _archive(conn):
+    Base.metadata.create_all(conn, tables=[ArchivedMonth.__table__])
+
+
+@migration(7, "ключ повторной заявки")
+def _dedup(conn):
+    add_missing_columns(conn)
+    create_index(conn, FormResponse, "ux_form_responses_dedup")
+
+
+@migration(8, "запросы на возврат месяцев из архива")
+def _restore_requests(conn):
+    add_missing_columns(conn)
+
+
+def current_version(conn) -> int:
+    _meta.create_all(conn)
+    version = conn.execute(select(schema_version.c.version)).scalar()
+    return version or 0
+
+
+def _stamp(conn, version: int):
+    conn.execute(schema_version.delete())
+    conn.execute(schema_version.insert().values(version=version))
+
+
+def upgrade(conn) -> bool:
+    """Доводит схему до последней версии. Вызывается через AsyncConnection.run_sync.
+    Возвращает False, если схема уже была актуальной"""
+    # Быстрый путь для каждого запуска: таблица версий есть и версия последняя
+    has_version = inspect(conn).has_table(schema_version.name)
+    if has_version and conn.execute(select(schema_version.c.version)).scalar() == head():
+        return False
+    is_new = not inspect(conn).get_table_names()
+    version = current_version(conn)
+    if is_new:
+        Base.metadata.create_all(conn)
+        # Виртуальной таблицы FTS нет в моделях — create_all её не создаёт
+        create_search_index(conn)
+        _stamp(conn, head())
+        logger.info(f"Создана схема БД версии {head()}")
+        return True
+    for target, description, fn in sorted(MIGRATIONS, key=lambda item: item[0]):
+        if target <= version:
+            continue
+        logger.info(f"Миграция {target}: {description}")
+        fn(conn)
+        _stamp(conn, target)
+    return True
@@ -1,35 +1,142 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Boolean, ForeignKey, DateTime, Float, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
+# Магазин, которому принадлежат данные, созданные до появления нескольких ботов
+DEFAULT_TENANT_ID = 1
+
+def tenant_column():
+    return Column(Integer, nullable=False, default=DEFAULT_TENANT_ID, server_default=text(str(DEFAULT_TENANT_ID)))
+
+class Tenant(Base):
+    """Магазин в режиме нескольких ботов (см. tenants.py)"""
+    __tablename__ = 'tenants'
+    id = Column(Integer, primary_key=True)
+    token = Column(String(128), nullable=False, unique=True)
+    admin_ids = Column(Text, nullable=False)  # "1,2,3"
+    title = Column(String(255), nullable=True)
+    is_active = Column(Boolean, nullable=False, default=True)
+    created_at = Column(DateTime, nullable=False)
+
 class BotSettings(Base):
     __tablename__ = 'bot_settings'
     id = Column(Integer, primary_key=True)
+    tenant_id = tenant_column()
     greeting_text = Column(Text, default="👋 Добро пожаловать! Выберите, что вас интересует:")
     greeting_photo = Column(String, nullable=True)  # file_id или URL
 
 class Button(Base):
     __tablename__ = 'buttons'
+    __table_args__ = (
+        # Текст активной кнопки уникален в пределах магазина: по нему ищется нажатая кнопка
+        Index("ux_buttons_tenant_active_text", "tenant_id", "text", unique=True,
+              sqlite_where=text("is_active = 1"), postgresql_where=text("is_active")),
+    )
     id = Column(Integer, primary_key=True)
+    tenant_id = tenant_column()
     text = Column(String(64), nullable=False)
     order = Column(Integer, default=0)
     is_active = Column(Boolean, default=True)
     response_type = Column(String(20), default='text')  # text, file, link, form
     response_content = Column(Text, nullable=True)  # текст/ссылка/file_id
     form_questions = Column(Text, nullable=True)  # JSON: ["Имя", "Задача", "Контакт"]
+    # file_id, полученный при загрузке локального файла, и отпечаток файла на момент загрузки
+    cached_file_id = Column(String, nullable=True)
+    cached_file_mtime = Column(Float, nullable=True)
+    cached_file_size = Column(Integer, nullable=True)
 
 class FormResponse(Base):
     __tablename__ = 'form_responses'
+    __table_args__ = (
+        Index("ix_form_responses_button_time", "button_id", "submitted_at"),
+        Index("ix_form_responses_user_time", "user_id", "submitted_at"),
+        Index("ix_form_responses_tenant_time", "tenant_id", "submitted_at"),
+        Index("ux_form_responses_dedup", "dedup_key", unique=True),
+    )
     id = Column(Integer, primary_key=True)
+    tenant_id = tenant_column()
     user_id = Column(Integer, nullable=False)
     button_id = Column(Integer, ForeignKey('buttons.id'))
     answers = Column(Text, nullable=False)  # JSON
-    created_at = Column(String, nullable=False)  # ISO строка
+    created_at = Column(String, nullable=False)  # время для показа, "%H:%M"
+    submitted_at = Column(DateTime, nullable=True)  # полная метка времени; у старых заявок пусто
+    dedup_key = Column(String(64), nullable=True)  # см. idempotency.submission_key
 
 class AdminSettings(Base):
     __tablename__ = 'admin_settings'
     id = Column(Integer, primary_key=True)
+    tenant_id = tenant_column()
     requests_chat_id = Column(Integer, nullable=True)  # ID группы для заявок
-    requests_template = Column(Text, default="📋 НОВАЯ ЗАЯВКА\nИмя: {answers[0]}\nЗадача: {answers[1]}\nКонтакт: {answers[2]}\nВремя: {time}")
\ No newline at end of file
+    requests_template = Column(Text, default="📋 НОВАЯ ЗАЯВКА\nИмя: {answers[0]}\nЗадача: {answers[1]}\nКонтакт: {answers[2]}\nВремя: {time}")
+
+class Notification(Base):
+    """Исходящее уведомление в группу заявок (outbox). Удаляется после отправки"""
+    __tablename__ = 'notifications'
+    id = Column(Integer, primary_key=True)
+    tenant_id = tenant_column()  # чьим ботом отправлять
+    chat_id = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    next_attempt_at = Column(DateTime, nullable=False, index=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+
+class FsmState(Base):
+    """Состояние FSM пользователя (см. storage.DatabaseStorage)"""
+    __tablename__ = 'fsm_states'
+    key = Column(String(255), primary_key=True)
+    state = Column(String(255), nullable=True)
+    data = Column(Text, nullable=False, default="{}")  # JSON
+    updated_at = Column(Float, nullable=False, index=True)  # unix time
+
+class StatCounter(Base):
+    """Предагрегированные счётчики для экрана статистики"""
+    __tablename__ = 'stat_counters'
+    period = Column(String(8), primary_key=True)  # hour, day, total
+    bucket = Column(DateTime, primary_key=True)  # начало часа/дня; для total — TOTAL_BUCKET
+    button_id = Column(Integer, primary_key=True)
+    metric = Column(String(16), primary_key=True)  # click, form
+    value = Column(Integer, nullable=False, default=0)
+
+class User(Base):
+    """Пользователь, хоть раз писавший боту (см. users.UserCollector)"""
+    __tablename__ = 'users'
+    id = Column(BigInteger, primary_key=True, autoincrement=False)  # Telegram user id
+    username = Column(String(64), nullable=True)
+    first_name = Column(String(255), nullable=True)
+    first_seen = Column(DateTime, nullable=False)
+    last_seen = Column(DateTime, nullable=False)
+    is_blocked = Column(Boolean, nullable=False, default=False)  # запретил боту писать ему
+
+class Broadcast(Base):
+    """Рассылка: копия сообщения админа всем пользователям (см. broadcast.BroadcastRunner)"""
+    __tablename__ = 'broadcasts'
+    id = Column(Integer, primary_key=True)
+    source_chat_id = Column(BigInteger, nullable=False)
+    source_message_id = Column(Integer, nullable=False)
+    status = Column(String(16), nullable=False, default="running")  # running, done, cancelled
+    created_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    # Контрольная точка: всем пользователям с id <= last_user_id рассылка уже ушла
+    last_user_id = Column(BigInteger, nullable=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    # Сообщение админу, в котором обновляется прогресс
+    progress_chat_id = Column(BigInteger, nullable=True)
+    progress_message_id = Column(Integer, nullable=True)
+
+class ArchivedMonth(Base):
+    """Месяц заявок магазина, перенесённый в архивный файл (см. archive.Archiver)"""
+    __tablename__ = 'archived_months'
+    tenant_id = Column(Integer, primary_key=True)
+    month = Column(String(7), primary_key=True)  # "2026-03"
+    rows = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False)
+    # Месяц возвращён в таблицу заявок — архиватор его не трогает
+    restored = Column(Boolean, nullable=False, default=False)
+    # Админ попросил вернуть месяц; возвращает фоновый архиватор (см. Archiver.request_restore)
+    restore_requested = Column(Boolean, nullable=False, default=False, server_default=text("false"))
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from sqlalchemy import select, delete, update, func
+
+from config import config
+from database import get_db
+from models import Notification
+from ratelimit import TokenBucket
+from tenants import tenant_registry
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+DIGEST_SEPARATOR = "\n\n———\n\n"
+FETCH_LIMIT = 200
+IDLE_POLL_SECONDS = 60
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 3600
+
+
+def build_digest(texts: List[str]) -> str:
+    return f"📋 Заявок в сводке: {len(texts)}" + DIGEST_SEPARATOR + DIGEST_SEPARATOR.join(texts)
+
+
+def take_digest(pending: List[Notification]) -> List[Notification]:
+    """Берёт из начала очереди столько уведомлений, сколько влезает в одно сообщение"""
+    group = [pending[0]]
+    size = len(build_digest([pending[0].text]))
+    for item in pending[1:]:
+        size += len(DIGEST_SEPARATOR) + len(item.text)
+        # Запас под рост числа в заголовке
+        if size + 8 > MESSAGE_LIMIT:
+            break
+        group.append(item)
+    return group
+
+
+class NotificationSender:
+    """Фоновая отправка уведомлений из таблицы notifications.
+
+    На каждый чат — своё ведро токенов (Telegram пропускает около 20 сообщений
+    в минуту в группу). Если очередь чата длиннее, чем можно отправить прямо
+    сейчас, накопившиеся уведомления склеиваются в сводки. Уведомление
+    отправляет бот магазина, которому принадлежит заявка.
+    """
+
+    def __init__(self, rate_per_minute: int = 20, max_attempts: int = 10):
+        self.rate_per_minute = rate_per_minute
+        self.max_attempts = max_attempts
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(), name="notification-sender")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def wake(self):
+        """Сообщает, что в outbox появились новые записи"""
+        self._wakeup.set()
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(rate=self.rate_per_minute / 60, capacity=self.rate_per_minute)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    async def _run(self):
+        while True:
+            try:
+                timeout = await self._tick()
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомлений: {e}")
+                timeout = BACKOFF_BASE_SECONDS
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+
+    async def _tick(self) -> float:
+        """Отправляет всё, что можно отправить сейчас. Возвращает паузу до следующего прохода"""
+        now = datetime.now()
+        async with get_db() as session:
+            rows = (await session.scalars(
+                select(Notification)
+                .where(Notification.next_attempt_at <= now)
+                .order_by(Notification.id)
+                .limit(FETCH_LIMIT)
+            )).all()
+
+        by_chat = defaultdict(list)
+        for row in rows:
+            by_chat[(row.tenant_id, row.chat_id)].append(row)
+
+        timeout = IDLE_POLL_SECONDS
+        sent = 0
+        for (tenant_id, chat_id), pending in by_chat.items():
+            bot = tenant_registry.bot(tenant_id)
+            bucket = self._bucket(chat_id)
+            while pending:
+                available = bucket.available()
+                if available < 1:
+                    break
+                # Отстаём от очереди — отправляем сводку вместо отдельных сообщений
+                group = pending[:1] if len(pending) <= available else take_digest(pending)
+                bucket.try_acquire()
+                if not await self._send(bot, chat_id, group, bucket):
+                    break
+                sent += 1
+                pending = pending[len(group):]
+            if pending:
+                timeout = min(timeout, max(bucket.delay(), 0.1))
+
+        if len(rows) == FETCH_LIMIT and sent:
+            # За выборкой есть ещё уведомления. Если же все вёдра пусты, сразу
+            # перечитывать ту же выборку незачем — ждём ближайшего токена
+            return 0
+        if len(rows) == FETCH_LIMIT:
+            return timeout
+        async with get_db() as session:
+            next_at = await session.scalar(
+                select(func.min(Notification.next_attempt_at)).where(Notification.next_attempt_at > now)
+            )
+        if next_at is not None:
+            timeout = min(timeout, max((next_at - datetime.now()).total_seconds(), 0))
+        return timeout
+
+    async def _send(self, bot: Optional[Bot], chat_id: int, group: List[Notification], bucket: TokenBucket) -> bool:
+        text = group[0].text if len(group) == 1 else build_digest([item.text for item in group])
+        ids = [item.id for item in group]
+        try:
+            if bot is None:
+                raise RuntimeError(f"бот магазина {group[0].tenant_id} не запущен")
+            await bot.send_message(chat_id=chat_id, text=text)
+        except TelegramRetryAfter as e:
+            # Флуд-контроль — не ошибка уведомления, попытку не засчитываем
+            logger.warning(f"Флуд-контроль в чате {chat_id}: ждём {e.retry_after} с")
+            bucket.pause(e.retry_after)
+            await self._postpone(ids, e.retry_after, str(e), count_attempt=False)
+            return False
+        except Exception as e:
+            attempts = max(item.attempts for item in group) + 1
+            if attempts >= self.max_attempts:
+                logger.error(f"Уведомление отброшено после {attempts} попыток: {e}")
+                await self._delete(ids)
+            else:
+                delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+                logger.error(f"Ошибка отправки в чат {chat_id}, повтор через {delay} с: {e}")
+                await self._postpone(ids, delay, str(e))
+            return False
+
+        await self._delete(ids)
+        logger.info(f"Заявка отправлена в группу (уведомлений: {len(ids)})")
+        return True
+
+    async def _delete(self, ids: List[int]):
+        async with get_db() as session:
+            await session.execute(delete(Notification).where(Notification.id.in_(ids)))
+
+    async def _postpone(self, ids: List[int], delay: float, error: str, count_attempt: bool = True):
+        values = {
+            "next_attempt_at": datetime.now() + timedelta(seconds=delay),
+            "last_error": error,
+        }
+        if count_attempt:
+            values["attempts"] = Notification.attempts + 1
+        async with get_db() as session:
+            await session.execute(update(Notification).where(Notification.id.in_(ids)).values(**values))
+
+
+notification_sender = NotificationSender(
+    rate_per_minute=config.NOTIFY_RATE_PER_MINUTE,
+    max_attempts=config.NOTIFY_MAX_ATTEMPTS,
+)
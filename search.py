@@ -0,0 +1,200 @@
+"""Полнотекстовый поиск по заявкам для админов.
+
+В SQLite заявки индексируются в виртуальной таблице FTS5 form_responses_fts
+(rowid = id заявки) той же транзакцией, что и их запись, поэтому поиск —
+это запрос к индексу, а не LIKE по всей таблице. Телефоны дополнительно
+индексируются одними цифрами, чтобы «+7 (999) 123-45-67» находился
+по «89991234567». В других СУБД поиск идёт простым ILIKE.
+"""
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import Integer, column, select, text
+
+from database import get_engine
+from forms import decode_answers
+from models import Button, FormResponse
+
+FTS_TABLE = "form_responses_fts"
+PAGE_SIZE = 5
+MAX_TERMS = 10
+MAX_ANSWER_PREVIEW = 300
+REBUILD_CHUNK = 5000
+# Сколько совпадений ещё сортировать по релевантности. bm25 считается для
+# каждого совпадения, и у частого слова на миллионе заявок это сотни
+# миллисекунд — такие выдачи идут от новых заявок к старым
+RANK_LIMIT = 1000
+# Значимая часть российского номера: без +7 / 8 в начале
+PHONE_DIGITS = 10
+
+_PHONE_QUERY = re.compile(r"[\d\s\-()+]+")
+_WORD = re.compile(r"\w+")
+
+
+def _digits(value: str) -> str:
+    return "".join(ch for ch in value if ch.isdigit())
+
+
+def document(answers: Sequence) -> str:
+    """Текст, который индексируется для заявки"""
+    parts = [str(answer) for answer in answers if answer is not None]
+    for part in list(parts):
+        digits = _digits(part)
+        if len(digits) >= 7:
+            parts.append(digits)
+            if len(digits) > PHONE_DIGITS:
+                parts.append(digits[-PHONE_DIGITS:])
+    return "\n".join(parts)
+
+
+def match_query(query: str) -> Optional[str]:
+    """Запрос FTS5 из того, что ввёл админ: все слова по префиксу, телефон — по цифрам"""
+    query = query.strip()
+    digits = _digits(query)
+    if _PHONE_QUERY.fullmatch(query) and len(digits) >= 7:
+        return f'"{digits[-PHONE_DIGITS:]}"*'
+    words = _WORD.findall(query.lower())[:MAX_TERMS]
+    if not words:
+        return None
+    # Кавычки: слова вроде AND/NOT/NEAR не превращаются в операторы
+    return " AND ".join(f'"{word}"*' for word in words)
+
+
+def _uses_fts(dialect_name: str) -> bool:
+    return dialect_name == "sqlite"
+
+
+# --- Схема (вызывается из миграций через run_sync) ---
+
+def create_search_index(conn):
+    if not _uses_fts(conn.dialect.name):
+        return
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+        "USING fts5(body, tenant_id UNINDEXED, tokenize='unicode61 remove_diacritics 2')"
+    ))
+
+
+def rebuild_search_index(conn):
+    """Заново индексирует все заявки порциями по REBUILD_CHUNK"""
+    if not _uses_fts(conn.dialect.name):
+        return
+    conn.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(FormResponse.id, FormResponse.tenant_id, FormResponse.answers)
+            .where(FormResponse.id > last_id).order_by(FormResponse.id).limit(REBUILD_CHUNK)
+        ).all()
+        if not rows:
+            return
+        conn.execute(_insert(), [
+            {"id": row.id, "body": document(decode_answers(row.answers)), "tenant_id": row.tenant_id} for row in rows
+        ])
+        last_id = rows[-1].id
+
+
+def _insert():
+    return text(f"INSERT INTO {FTS_TABLE} (rowid, body, tenant_id) VALUES (:id, :body, :tenant_id)")
+
+
+# --- Индексация и поиск ---
+
+async def index_responses(session, rows: Sequence[FormResponse]):
+    """Добавляет в индекс заявки, уже получившие id (после flush), в транзакции session"""
+    if not rows or not _uses_fts(get_engine().dialect.name):
+        return
+    await session.execute(_insert(), [
+        {"id": row.id, "body": document(decode_answers(row.answers)), "tenant_id": row.tenant_id} for row in rows
+    ])
+
+
+async def unindex_responses(session, ids: Sequence[int]):
+    """Убирает заявки из индекса — вместе с их удалением из таблицы"""
+    if not ids or not _uses_fts(get_engine().dialect.name):
+        return
+    await session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), [{"id": i} for i in ids])
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    id: int
+    submitted_at: Optional[datetime]
+    created_at: str
+    user_id: int
+    button: Optional[str]
+    answers: list
+
+
+async def search_responses(session, tenant_id: int, query: str, page: int = 0,
+                           page_size: int = PAGE_SIZE) -> Tuple[List[SearchHit], bool]:
+    """Страница найденных заявок магазина и есть ли следующая.
+    Самые подходящие идут первыми, а если совпадений больше RANK_LIMIT — самые новые"""
+    if _uses_fts(get_engine().dialect.name):
+        match = match_query(query)
+        if match is None:
+            return [], False
+        params = {"match": match, "tenant_id": tenant_id}
+        matched = f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match AND tenant_id = :tenant_id"
+        # .columns() делает запрос TextualSelect: сессия отправит его на движок для чтения
+        found = await session.scalar(
+            text(f"SELECT count(*) AS found FROM ({matched} LIMIT :cap)").columns(column("found", Integer)),
+            {**params, "cap": RANK_LIMIT + 1},
+        )
+        order = "rank" if found <= RANK_LIMIT else "rowid DESC"
+        ids = (await session.execute(
+            text(f"{matched} ORDER BY {order} LIMIT :limit OFFSET :offset").columns(column("rowid", Integer)),
+            {**params, "limit": page_size + 1, "offset": page * page_size},
+        )).scalars().all()
+    else:
+        ids = (await session.scalars(
+            select(FormResponse.id)
+            .where(FormResponse.tenant_id == tenant_id, FormResponse.answers.ilike(f"%{query.strip()}%"))
+            .order_by(FormResponse.id.desc())
+            .limit(page_size + 1).offset(page * page_size)
+        )).all()
+    has_more = len(ids) > page_size
+    ids = ids[:page_size]
+    if not ids:
+        return [], False
+    rows = {row.id: row for row in (await session.execute(
+        select(FormResponse.id, FormResponse.submitted_at, FormResponse.created_at, FormResponse.user_id,
+               Button.text, FormResponse.answers)
+        .outerjoin(Button, Button.id == FormResponse.button_id)
+        .where(FormResponse.id.in_(ids))
+    )).all()}
+    hits = [
+        SearchHit(row.id, row.submitted_at, row.created_at, row.user_id, row.text, decode_answers(row.answers))
+        for row in (rows.get(response_id) for response_id in ids) if row is not None
+    ]
+    return hits, has_more
+
+
+def format_hits(query: str, hits: List[SearchHit], page: int) -> str:
+    if not hits:
+        return f"🔎 По запросу «{query}» ничего не найдено." if page == 0 else "🔎 Больше ничего не найдено."
+    lines = [f"🔎 «{query}», страница {page + 1}:"]
+    for hit in hits:
+        moment = hit.submitted_at.strftime("%d.%m.%Y %H:%M") if hit.submitted_at else hit.created_at
+        answers = " · ".join(str(answer) for answer in hit.answers if answer is not None)
+        if len(answers) > MAX_ANSWER_PREVIEW:
+            answers = answers[:MAX_ANSWER_PREVIEW] + "…"
+        lines.append("")
+        lines.append(f"#{hit.id} · {moment} · {hit.button or 'без кнопки'} · ID {hit.user_id}")
+        lines.append(answers or "—")
+    return "\n".join(lines)
+
+
+def search_keyboard(page: int, has_more: bool) -> InlineKeyboardMarkup:
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=f"admin:find_page:{page - 1}"))
+    if has_more:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=f"admin:find_page:{page + 1}"))
+    rows = [nav] if nav else []
+    rows.append([InlineKeyboardButton(text="🔎 Новый поиск", callback_data="admin:find"),
+                 InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:main")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
@@ -0,0 +1,67 @@
+"""Замер холодного старта.
+
+Этапы запуска отмечаются относительно момента старта процесса (по /proc,
+а где его нет — от импорта этого модуля), так что в замер входит и запуск
+интерпретатора с импортами. На первом апдейте в лог пишется отчёт по этапам,
+а длительности попадают в метрику bot_startup_seconds.
+"""
+import logging
+import os
+import time
+from typing import List, Tuple
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+startup_seconds = registry.histogram(
+    "bot_startup_seconds", "Время от запуска процесса до этапа старта", ["stage"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+)
+
+
+def process_started_at() -> float:
+    """Время запуска текущего процесса по часам time.time()"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Имя процесса в скобках может содержать пробелы — поля считаем после него
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        started_ticks = int(fields[19])
+        return time.time() - uptime + started_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+class StartupTimer:
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.stages: List[Tuple[str, float]] = []
+        self.reported = False
+
+    def mark(self, stage: str):
+        """Отмечает конец этапа"""
+        moment = time.time()
+        self.stages.append((stage, moment))
+        startup_seconds.observe(moment - self.started_at, stage)
+
+    def report(self) -> str:
+        lines = []
+        previous = self.started_at
+        for stage, moment in self.stages:
+            lines.append(f"  {stage}: +{(moment - previous) * 1000:.0f} мс (с запуска {moment - self.started_at:.3f} с)")
+            previous = moment
+        total = previous - self.started_at
+        return "\n".join([f"Холодный старт: {total:.3f} с до первого апдейта"] + lines)
+
+    async def first_update_middleware(self, handler, event, data):
+        """Внешний middleware на dp.update: на первом апдейте пишет отчёт"""
+        if not self.reported:
+            self.reported = True
+            self.mark("первый апдейт")
+            logger.info(self.report())
+        return await handler(event, data)
+
+
+startup_timer = StartupTimer(process_started_at())
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import select, func
+
+from config import config
+from database import get_db, upsert
+from models import StatCounter, FormResponse
+
+logger = logging.getLogger(__name__)
+
+CLICK = "click"
+FORM = "form"
+TOTAL_BUCKET = datetime(1970, 1, 1)
+
+
+def hour_start(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def expand(events: Dict[Tuple[datetime, int, str], int]):
+    """Раскладывает почасовые события по часовым, дневным и общим счётчикам"""
+    rows = Counter()
+    for (hour, button_id, metric), value in events.items():
+        rows[("hour", hour, button_id, metric)] += value
+        rows[("day", day_start(hour), button_id, metric)] += value
+        rows[("total", TOTAL_BUCKET, button_id, metric)] += value
+    return [
+        {"period": period, "bucket": bucket, "button_id": button_id, "metric": metric, "value": value}
+        for (period, bucket, button_id, metric), value in rows.items()
+    ]
+
+
+async def increment(session, events: Dict[Tuple[datetime, int, str], int]):
+    """Прибавляет события к счётчикам в рамках переданной сессии"""
+    rows = expand(events)
+    if not rows:
+        return
+    stmt = upsert(StatCounter.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["period", "bucket", "button_id", "metric"],
+        set_={"value": StatCounter.__table__.c.value + stmt.excluded.value},
+    )
+    await session.execute(stmt, rows)
+
+
+async def count_forms(session, items: Iterable[Tuple[datetime, Optional[int]]]):
+    """Учитывает заявки (время, id кнопки) той же транзакцией, что и их запись"""
+    events = Counter((hour_start(moment), button_id or 0, FORM) for moment, button_id in items)
+    await increment(session, events)
+
+
+class ClickCollector:
+    """Копит нажатия кнопок в памяти и периодически сбрасывает их в счётчики,
+    чтобы пользовательский путь не делал запросов к БД"""
+
+    def __init__(self, flush_interval: float = 10):
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[datetime, int, str], int] = defaultdict(int)
+        self._task: Optional[asyncio.Task] = None
+
+    def record_click(self, button_id: int):
+        self._pending[(hour_start(datetime.now()), button_id, CLICK)] += 1
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="stats-flush")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи статистики: {e}")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        events, self._pending = self._pending, defaultdict(int)
+        try:
+            async with get_db() as session:
+                await increment(session, events)
+        except Exception:
+            for key, value in events.items():
+                self._pending[key] += value
+            raise
+
+
+async def backfill_totals(session):
+    """Заполняет общие счётчики заявками, сохранёнными до появления статистики"""
+    if await session.scalar(select(StatCounter.period).limit(1)) is not None:
+        return
+    rows = (await session.execute(
+        select(FormResponse.button_id, func.count()).group_by(FormResponse.button_id)
+    )).all()
+    session.add_all([
+        StatCounter(period="total", bucket=TOTAL_BUCKET, button_id=button_id or 0, metric=FORM, value=count)
+        for button_id, count in rows
+    ])
+
+
+async def load_report(session, button_ids: Optional[Iterable[int]] = None, now: Optional[datetime] = None) -> dict:
+    """Собирает данные для экрана статистики. Читает только счётчики,
+    поэтому время не зависит от числа заявок. button_ids — кнопки магазина"""
+    now = now or datetime.now()
+    today = day_start(now)
+
+    def sums(rows):
+        result = defaultdict(lambda: {CLICK: 0, FORM: 0})
+        for button_id, metric, value in rows:
+            result[button_id][metric] += value
+        return result
+
+    base = select(StatCounter.button_id, StatCounter.metric, func.sum(StatCounter.value)).group_by(
+        StatCounter.button_id, StatCounter.metric
+    )
+    if button_ids is not None:
+        base = base.where(StatCounter.button_id.in_(list(button_ids)))
+    total = sums((await session.execute(base.where(StatCounter.period == "total"))).all())
+    last_24h = sums((await session.execute(base.where(
+        StatCounter.period == "hour", StatCounter.bucket > hour_start(now) - timedelta(hours=24)
+    ))).all())
+    last_7d = sums((await session.execute(base.where(
+        StatCounter.period == "day", StatCounter.bucket > today - timedelta(days=7)
+    ))).all())
+    day_today = sums((await session.execute(base.where(
+        StatCounter.period == "day", StatCounter.bucket == today
+    ))).all())
+    return {"total": total, "today": day_today, "24h": last_24h, "7d": last_7d}
+
+
+def format_report(report: dict, button_names: Dict[int, str]) -> str:
+    def forms(period):
+        return sum(item[FORM] for item in report[period].values())
+
+    lines = [
+        "📊 Статистика:",
+        f"Всего заявок: {forms('total')}",
+        f"Сегодня: {forms('today')}",
+        f"За 24 часа: {forms('24h')}",
+        f"За 7 дней: {forms('7d')}",
+    ]
+    per_button = report["total"]
+    if per_button:
+        lines.append("")
+        lines.append("По кнопкам (нажатия → заявки, конверсия):")
+        for button_id, item in sorted(per_button.items(), key=lambda kv: -kv[1][CLICK]):
+            name = button_names.get(button_id, f"#{button_id}" if button_id else "без кнопки")
+            if item[FORM] and item[CLICK]:
+                lines.append(f"• {name}: {item[CLICK]} → {item[FORM]} ({item[FORM] / item[CLICK]:.0%})")
+            elif item[FORM]:
+                lines.append(f"• {name}: заявок {item[FORM]}")
+            else:
+                lines.append(f"• {name}: {item[CLICK]}")
+    return "\n".join(lines)
+
+
+click_collector = ClickCollector(flush_interval=config.STATS_FLUSH_SECONDS)
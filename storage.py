@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy import delete
+
+from config import config
+from database import get_db, upsert
+from models import FsmState
+
+logger = logging.getLogger(__name__)
+
+EMPTY_DATA = "{}"
+# Ограничение на число параметров в одном IN (...) / executemany
+CHUNK_SIZE = 500
+
+
+@dataclass(frozen=True)
+class _Record:
+    state: Optional[str]
+    data: str  # JSON: в кэше лежит строка, чтобы хендлеры не могли испортить его мутацией
+    updated_at: float
+
+    @property
+    def is_empty(self) -> bool:
+        return self.state is None and self.data == EMPTY_DATA
+
+
+class DatabaseStorage(BaseStorage):
+    """Хранилище FSM в таблице fsm_states.
+
+    Чтения идут через LRU-кэш (в нём же запоминается отсутствие состояния),
+    записи копятся и сбрасываются в БД одной транзакцией раз в flush_interval
+    секунд. Состояния, не менявшиеся дольше ttl секунд, считаются брошенными
+    и удаляются периодической чисткой.
+    """
+
+    def __init__(self, ttl: float = 86400, cache_size: int = 10000,
+                 flush_interval: float = 0.2, sweep_interval: float = 600):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._dirty: Dict[str, _Record] = {}
+        self._flushing: Dict[str, _Record] = {}
+        self._flush_lock = asyncio.Lock()
+        self._tasks = []
+
+    @staticmethod
+    def build_key(key: StorageKey) -> str:
+        return ":".join(str(part) if part is not None else "" for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+
+    def _ensure_started(self):
+        if self._tasks:
+            return
+        if self.flush_interval > 0:
+            self._tasks.append(asyncio.create_task(self._periodic(self.flush_interval, self.flush)))
+        if self.ttl > 0 and self.sweep_interval > 0:
+            self._tasks.append(asyncio.create_task(self._periodic(self.sweep_interval, self.sweep)))
+
+    async def _periodic(self, interval: float, job):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await job()
+            except Exception as e:
+                logger.error(f"Ошибка фоновой задачи хранилища FSM: {e}")
+
+    def _expired(self, record: _Record) -> bool:
+        return self.ttl > 0 and record.updated_at < time.time() - self.ttl
+
+    def _remember(self, key: str, record: _Record):
+        if self.cache_size <= 0:
+            return
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: str) -> _Record:
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+        else:
+            record = self._dirty.get(key) or self._flushing.get(key)
+        if record is None:
+            async with get_db() as session:
+                row = await session.get(FsmState, key)
+                # Отсутствие состояния тоже кэшируем: это самый частый случай
+                loaded = _Record(row.state, row.data, row.updated_at) if row else _Record(None, EMPTY_DATA, time.time())
+            # Пока шёл запрос, запись могла быть изменена — свежая версия важнее
+            record = self._cache.get(key) or self._dirty.get(key) or self._flushing.get(key) or loaded
+            self._remember(key, record)
+        if self._expired(record):
+            return _Record(None, EMPTY_DATA, 0.0)
+        return record
+
+    async def _save(self, key: str, state: Optional[str], data: str):
+        self._ensure_started()
+        record = _Record(state, data, time.time())
+        self._remember(key, record)
+        self._dirty[key] = record
+        if self.flush_interval <= 0:
+            await self.flush()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        key = self.build_key(key)
+        current = await self._load(key)
+        state = state.state if isinstance(state, State) else state
+        await self._save(key, state, current.data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(self.build_key(key))).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        key = self.build_key(key)
+        current = await self._load(key)
+        await self._save(key, current.state, json.dumps(data, ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return json.loads((await self._load(self.build_key(key))).data)
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            self._flushing, self._dirty = self._dirty, {}
+            try:
+                cleared = [key for key, record in self._flushing.items() if record.is_empty]
+                rows = [
+                    {"key": key, "state": record.state, "data": record.data, "updated_at": record.updated_at}
+                    for key, record in self._flushing.items() if not record.is_empty
+                ]
+                async with get_db() as session:
+                    for i in range(0, len(cleared), CHUNK_SIZE):
+                        await session.execute(delete(FsmState).where(FsmState.key.in_(cleared[i:i + CHUNK_SIZE])))
+                    if rows:
+                        stmt = upsert(FsmState.__table__)
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=["key"],
+                            set_={"state": stmt.excluded.state, "data": stmt.excluded.data,
+                                  "updated_at": stmt.excluded.updated_at},
+                        )
+                        for i in range(0, len(rows), CHUNK_SIZE):
+                            await session.execute(stmt, rows[i:i + CHUNK_SIZE])
+            except Exception:
+                # Не записалось — вернём в очередь, не затирая более свежие изменения
+                for key, record in self._flushing.items():
+                    self._dirty.setdefault(key, record)
+                raise
+            finally:
+                self._flushing = {}
+
+    async def sweep(self):
+        """Удаляет брошенные состояния из БД и кэша"""
+        cutoff = time.time() - self.ttl
+        async with get_db() as session:
+            result = await session.execute(delete(FsmState).where(FsmState.updated_at < cutoff))
+        for key in [key for key, record in self._cache.items() if record.updated_at < cutoff]:
+            del self._cache[key]
+        if result.rowcount:
+            logger.info(f"Удалено брошенных состояний FSM: {result.rowcount}")
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+
+
+def create_storage() -> DatabaseStorage:
+    return DatabaseStorage(
+        ttl=config.FSM_TTL_SECONDS,
+        cache_size=config.FSM_CACHE_SIZE,
+        flush_interval=config.FSM_FLUSH_MS / 1000,
+        sweep_interval=config.FSM_SWEEP_SECONDS,
+    )
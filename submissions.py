@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from functools import cached_property
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from config import config
+from database import get_db
+from idempotency import duplicates_total, submission_keys
+from models import FormResponse, Notification
+from notifier import notification_sender
+from search import index_responses
+from stats import count_forms
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class SubmissionRejected(Exception):
+    """Очередь переполнена или остановлена — заявку нужно отправить позже"""
+
+
+@dataclass
+class Submission:
+    tenant_id: int
+    user_id: int
+    button_id: int
+    answers: List[str]
+    submitted_at: datetime
+    # Уведомление для группы заявок, пишется в outbox той же транзакцией
+    notify_chat_id: Optional[int] = None
+    notify_text: Optional[str] = None
+    future: Optional[asyncio.Future] = field(default=None, repr=False)
+    # Такая же заявка уже записана — эта отброшена, submit() вернул id записанной
+    duplicate: bool = False
+
+    @cached_property
+    def dedup_keys(self) -> Tuple[str, str]:
+        """Ключ этой заявки и ключ её повтора из предыдущего интервала"""
+        return submission_keys(self.tenant_id, self.user_id, self.button_id, self.answers,
+                               self.submitted_at, config.DEDUP_WINDOW_SECONDS)
+
+    def to_row(self) -> FormResponse:
+        return FormResponse(
+            tenant_id=self.tenant_id,
+            user_id=self.user_id,
+            button_id=self.button_id,
+            answers=json.dumps(self.answers, ensure_ascii=False),
+            created_at=self.submitted_at.strftime("%H:%M"),
+            submitted_at=self.submitted_at,
+            dedup_key=self.dedup_keys[0]
+        )
+
+
+class SubmissionQueue:
+    """Очередь отложенной записи заявок.
+
+    Заявки копятся и фиксируются одной транзакцией, как только набирается
+    batch_size штук или проходит max_latency секунд с первой заявки в пачке.
+    submit() возвращает управление только после фиксации пачки в БД.
+    """
+
+    def __init__(self, batch_size: int = 100, max_latency: float = 0.05,
+                 max_size: int = 1000, put_timeout: float = 5.0):
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.max_size = max_size
+        self.put_timeout = put_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def start(self):
+        if self._worker is not None:
+            return
+        self._closing = False
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._worker = asyncio.create_task(self._run(), name="submission-queue")
+
+    async def stop(self):
+        """Перестаёт принимать заявки и дожидается записи всего, что уже в очереди"""
+        if self._worker is None:
+            return
+        self._closing = True
+        await self._queue.put(_STOP)
+        await self._worker
+        self._worker = None
+        # Заявки отправителей, ждавших места в полной очереди в момент остановки
+        while True:
+            leftovers = []
+            while not self._queue.empty():
+                leftovers.append(self._queue.get_nowait())
+            if not leftovers:
+                break
+            await self._flush(leftovers)
+
+    async def submit(self, submission: Submission) -> int:
+        """Ставит заявку в очередь и ждёт её записи. Возвращает id FormResponse"""
+        if self._worker is None or self._closing:
+            raise SubmissionRejected("очередь заявок не запущена")
+        submission.future = asyncio.get_running_loop().create_future()
+        try:
+            # Если очередь полна, ждём освобождения места не дольше put_timeout
+            await asyncio.wait_for(self._queue.put(submission), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            raise SubmissionRejected("очередь заявок переполнена") from None
+        return await asyncio.shield(submission.future)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Submission]):
+        try:
+            await self._write(batch)
+        except Exception as e:
+            logger.error(f"Ошибка пакетной записи {len(batch)} заявок: {e}")
+            # Пачка откатилась целиком: пишем по одной, чтобы одна плохая заявка
+            # не лишила подтверждения остальные
+            if len(batch) > 1:
+                for submission in batch:
+                    await self._flush([submission])
+                return
+            submission = batch[0]
+            if not submission.future.done():
+                submission.future.set_exception(e)
+
+    async def _write(self, batch: List[Submission]):
+        async with get_db() as session:
+            # Повторы отбрасываются до вставки: уже записанные (в том числе другим
+            # процессом) и одинаковые внутри пачки
+            window = timedelta(seconds=config.DEDUP_WINDOW_SECONDS)
+            keys = {key for submission in batch for key in submission.dedup_keys}
+            stored = {row.dedup_key: row for row in (await session.execute(
+                select(FormResponse.dedup_key, FormResponse.id, FormResponse.submitted_at)
+                .where(FormResponse.dedup_key.in_(keys))
+            )).all()}
+            fresh: Dict[str, FormResponse] = {}
+            # Строка заявки для каждой из пачки: своя новая или уже записанная такая же
+            targets = []
+            accepted = []
+            for submission in batch:
+                original = None
+                for key in submission.dedup_keys:
+                    row = stored.get(key) or fresh.get(key)
+                    if row is not None and submission.submitted_at - row.submitted_at < window:
+                        original = row
+                        break
+                if original is not None:
+                    submission.duplicate = True
+                    targets.append(original)
+                    continue
+                row = fresh[submission.dedup_keys[0]] = submission.to_row()
+                targets.append(row)
+                accepted.append(submission)
+            rows = list(fresh.values())
+            now = datetime.now()
+            notifications = [
+                Notification(tenant_id=submission.tenant_id, chat_id=submission.notify_chat_id,
+                             text=submission.notify_text, created_at=now, next_attempt_at=now)
+                for submission in accepted if submission.notify_chat_id and submission.notify_text
+            ]
+            session.add_all(rows)
+            session.add_all(notifications)
+            # id заявок нужны индексу поиска — он пополняется в той же транзакции
+            await session.flush()
+            await index_responses(session, rows)
+            await count_forms(session, [(submission.submitted_at, submission.button_id) for submission in accepted])
+        # Выход из get_db() — это commit, после него заявки на диске
+        for submission, row in zip(batch, targets):
+            if not submission.future.done():
+                submission.future.set_result(row.id)
+        duplicates = len(batch) - len(accepted)
+        if duplicates:
+            duplicates_total.inc("submission", amount=duplicates)
+        logger.info(f"Записано заявок: {len(rows)}" + (f", повторов отброшено: {duplicates}" if duplicates else ""))
+        if notifications:
+            notification_sender.wake()
+
+
+submission_queue = SubmissionQueue(
+    batch_size=config.SUBMIT_BATCH_SIZE,
+    max_latency=config.SUBMIT_MAX_LATENCY_MS / 1000,
+    max_size=config.SUBMIT_QUEUE_SIZE,
+    put_timeout=config.SUBMIT_PUT_TIMEOUT,
+)
@@ -0,0 +1,161 @@
+"""Несколько магазинов в одном процессе.
+
+Каждый магазин — строка таблицы tenants со своим токеном и админами; его
+кнопки, настройки и заявки помечены tenant_id. Все боты обслуживает один
+Dispatcher, одна база и одни фоновые задачи, а магазин апдейта определяется
+по боту, который его получил. Без MULTI_TENANT магазин один — DEFAULT_TENANT_ID
+с токеном и админами из .env.
+
+    python tenants.py add <токен> --admins 1,2 --title "Цветы"
+    python tenants.py list
+    python tenants.py disable <id>
+
+Новые и отключённые магазины подхватываются при перезапуске.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+from aiogram import Bot
+from sqlalchemy import select, update
+
+from config import config
+from models import DEFAULT_TENANT_ID, Tenant
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TenantEntry:
+    id: int
+    token: str
+    admin_ids: FrozenSet[int]
+    title: str = ""
+
+    @property
+    def bot_id(self) -> int:
+        # Числовая часть токена — id бота, getMe для этого не нужен
+        return int(self.token.split(":", 1)[0])
+
+
+def parse_admin_ids(raw: str) -> FrozenSet[int]:
+    return frozenset(int(x) for x in raw.split(",") if x.strip())
+
+
+def default_tenant() -> TenantEntry:
+    return TenantEntry(id=DEFAULT_TENANT_ID, token=config.BOT_TOKEN, admin_ids=frozenset(config.ADMIN_IDS))
+
+
+async def load_tenants(session) -> List[TenantEntry]:
+    """Магазины, которые обслуживает этот процесс"""
+    if not config.MULTI_TENANT:
+        return [default_tenant()]
+    rows = (await session.scalars(select(Tenant).where(Tenant.is_active == True).order_by(Tenant.id))).all()
+    return [TenantEntry(id=row.id, token=row.token, admin_ids=parse_admin_ids(row.admin_ids), title=row.title or "")
+            for row in rows]
+
+
+class TenantRegistry:
+    """Магазины процесса и их боты: по боту апдейта — магазин, по магазину — бот"""
+
+    def __init__(self):
+        self._tenants: Dict[int, TenantEntry] = {}
+        self._by_bot_id: Dict[int, TenantEntry] = {}
+        self._bots: Dict[int, Bot] = {}
+
+    def set_tenants(self, tenants: Iterable[TenantEntry]):
+        self._tenants = {tenant.id: tenant for tenant in tenants}
+        self._by_bot_id = {tenant.bot_id: tenant for tenant in self._tenants.values()}
+
+    def tenants(self) -> List[TenantEntry]:
+        return list(self._tenants.values())
+
+    def bind(self, bot: Bot) -> Optional[TenantEntry]:
+        """Запоминает бот магазина; бот с незнакомым токеном не привязывается"""
+        tenant = self._by_bot_id.get(bot.id)
+        if tenant is None or tenant.token != bot.token:
+            logger.error(f"Бот {bot.id} не принадлежит ни одному магазину")
+            return None
+        self._bots[tenant.id] = bot
+        return tenant
+
+    def for_bot(self, bot_id: int) -> Optional[TenantEntry]:
+        return self._by_bot_id.get(bot_id)
+
+    def bot(self, tenant_id: int) -> Optional[Bot]:
+        return self._bots.get(tenant_id)
+
+
+tenant_registry = TenantRegistry()
+
+
+async def tenant_middleware(handler, event, data):
+    """Внешний middleware на dp.update: кладёт в data магазин бота, получившего апдейт"""
+    tenant = tenant_registry.for_bot(data["bot"].id)
+    if tenant is None:
+        logger.warning(f"Апдейт для неизвестного бота {data['bot'].id} пропущен")
+        return None
+    data["tenant"] = tenant
+    return await handler(event, data)
+
+
+# --- Управление магазинами из командной строки ---
+
+async def _add(args):
+    from database import get_db, init_db, seed_tenant
+
+    admin_ids = parse_admin_ids(args.admins)
+    if not admin_ids:
+        raise SystemExit("Укажите хотя бы одного админа")
+    await init_db()
+    async with get_db() as session:
+        tenant = Tenant(token=args.token, admin_ids=",".join(map(str, sorted(admin_ids))), title=args.title,
+                        is_active=True, created_at=datetime.now())
+        session.add(tenant)
+        await session.flush()
+        await seed_tenant(session, tenant.id)
+    print(f"Магазин {tenant.id} добавлен; чтобы бот заработал, перезапустите процесс")
+
+
+async def _list(args):
+    from database import get_db, init_db
+
+    await init_db()
+    async with get_db() as session:
+        for row in (await session.scalars(select(Tenant).order_by(Tenant.id))).all():
+            status = "активен" if row.is_active else "отключён"
+            print(f"{row.id:>4}  {row.token.split(':', 1)[0]:>12}  {status:<9} {row.title or ''}  админы: {row.admin_ids}")
+
+
+async def _disable(args):
+    from database import get_db, init_db
+
+    await init_db()
+    async with get_db() as session:
+        await session.execute(update(Tenant).where(Tenant.id == args.id).values(is_active=False))
+    print(f"Магазин {args.id} отключён")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Магазины в режиме нескольких ботов")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="добавить магазин")
+    add.add_argument("token")
+    add.add_argument("--admins", required=True, help="Telegram ID админов через запятую")
+    add.add_argument("--title", default="")
+    add.set_defaults(run=_add)
+    commands.add_parser("list", help="список магазинов").set_defaults(run=_list)
+    disable = commands.add_parser("disable", help="отключить магазин")
+    disable.add_argument("id", type=int)
+    disable.set_defaults(run=_disable)
+    args = parser.parse_args(argv)
+    asyncio.run(args.run(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
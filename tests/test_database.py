@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, select, text, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from database import LazySession, async_database_url
+from models import Base, Tenant
+
+
+def run(scenario):
+    """Прогоняет scenario(session) в LazySession поверх отдельной базы в памяти;
+    возвращает has_changes после сценария и названия магазинов после finish()"""
+    async def main():
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all, tables=[Tenant.__table__])
+            await conn.execute(insert(Tenant).values(id=1, title="old", token="t", admin_ids="", created_at=datetime.now()))
+        factory = async_sessionmaker(engine, expire_on_commit=False)
+        session = LazySession(factory)
+        await scenario(session)
+        changed = session.has_changes
+        await session.finish()
+        async with factory() as check:
+            titles = (await check.scalars(select(Tenant.title).order_by(Tenant.id))).all()
+        await engine.dispose()
+        return changed, titles
+    return asyncio.run(main())
+
+
+async def nothing(session):
+    pass
+
+
+async def read(session):
+    await session.scalar(select(Tenant.title))
+    await session.scalar(text("SELECT title FROM tenants").columns(Tenant.title))
+
+
+async def core_update(session):
+    await session.execute(update(Tenant).values(title="core"))
+
+
+async def raw_update(session):
+    await session.execute(text("UPDATE tenants SET title = 'raw'"))
+
+
+async def orm_change(session):
+    tenant = await session.get(Tenant, 1)
+    tenant.title = "orm"
+
+
+async def committed_then_read(session):
+    await session.execute(update(Tenant).values(title="committed"))
+    await session.commit()
+    await session.scalar(select(Tenant.title))
+
+
+@pytest.mark.parametrize("scenario, changed, titles", [
+    (nothing, False, ["old"]),
+    (read, False, ["old"]),
+    (core_update, True, ["core"]),
+    (raw_update, True, ["raw"]),
+    (orm_change, True, ["orm"]),
+    (committed_then_read, False, ["committed"]),
+])
+def test_lazy_session_commits_only_writes(scenario, changed, titles):
+    assert run(scenario) == (changed, titles)
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("sqlite:///bot.db", "sqlite+aiosqlite:///bot.db"),
+    ("sqlite://", "sqlite+aiosqlite://"),
+    ("postgresql://u:p@db/shop", "postgresql+asyncpg://u:p@db/shop"),
+    ("postgres://u:p@db/shop", "postgresql+asyncpg://u:p@db/shop"),
+    ("postgresql+psycopg2://u:p@db/shop", "postgresql+asyncpg://u:p@db/shop"),
+    ("postgresql+asyncpg://u:p@db/shop", "postgresql+asyncpg://u:p@db/shop"),
+])
+def test_async_database_url(url, expected):
+    assert async_database_url(url) == expected
@@ -0,0 +1,35 @@
+import csv
+import gzip
+import json
+from datetime import datetime
+
+from export import _ArchivedRow, _Writer
+
+ANSWERS = ["=HYPERLINK(\"http://evil\", \"Жми\")", "+7 (999) 123-45-67", "+SUM(A1)", "-1+1", "@cmd", "Иван", None]
+
+
+def write(path, fmt):
+    row = _ArchivedRow(1, datetime(2026, 9, 1, 12, 0), "12:00", 5, 2, "=Кнопка", json.dumps(ANSWERS))
+    writer = _Writer(str(path), fmt, ["Имя", "=Вопрос"])
+    writer.write([row])
+    writer.close()
+
+
+def test_csv_cells_cannot_become_formulas(tmp_path):
+    path = tmp_path / "out.csv.gz"
+    write(path, "csv")
+    with gzip.open(path, "rt", encoding="utf-8-sig", newline="") as f:
+        header, row = list(csv.reader(f))
+    assert header[-2:] == ["Имя", "'=Вопрос"]
+    assert row[5] == "'=Кнопка"
+    assert row[6:] == ["'=HYPERLINK(\"http://evil\", \"Жми\")", "+7 (999) 123-45-67", "'+SUM(A1)", "'-1+1", "'@cmd",
+                       "Иван", ""]
+
+
+def test_jsonl_keeps_answers_as_typed(tmp_path):
+    path = tmp_path / "out.jsonl.gz"
+    write(path, "jsonl")
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        record = json.loads(f.readline())
+    assert record["answers"] == ANSWERS
+    assert record["button"] == "=Кнопка"
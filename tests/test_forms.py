@@ -0,0 +1,144 @@
+import json
+
+import pytest
+
+from forms import DEFAULT_QUESTIONS, END, FormError, FormProgress, compile_form, decode_answers, question_texts
+
+
+def fill(form, answers):
+    """Проходит анкету ответами и возвращает сохранённый прогресс"""
+    progress = FormProgress(form_id=1, step=0, answers=[])
+    for answer in answers:
+        step = form.steps[progress.step]
+        value = step.validate(answer)
+        assert value is not None, f"ответ {answer!r} не принят на шаге {step.key}"
+        if progress.record(form, value) == END:
+            break
+    return progress
+
+
+def test_plain_strings_go_in_order_and_end_after_last():
+    form = compile_form('["Имя", "Задача", "Контакт"]')
+    assert form.questions == ("Имя", "Задача", "Контакт")
+    assert [step.next for step in form.steps] == [1, 2, END]
+    progress = fill(form, ["Иван", "Ремонт", "+7 999 123-45-67"])
+    assert progress.step == END
+    assert progress.answers == ["Иван", "Ремонт", "+7 999 123-45-67"]
+
+
+@pytest.mark.parametrize("raw", ["[]", None])
+def test_empty_definition_uses_default_questions(raw):
+    assert compile_form(raw).questions == DEFAULT_QUESTIONS
+
+
+def test_already_parsed_list_is_accepted():
+    assert compile_form(["Имя"]).questions == ("Имя",)
+
+
+def test_branch_skips_steps_and_leaves_none_for_them():
+    form = compile_form([
+        {"id": "name", "text": "Имя?"},
+        {"text": "Доставка?", "options": ["Да", "Нет"], "next": {"Нет": "contact"}},
+        {"text": "Адрес?"},
+        {"id": "contact", "text": "Контакт?", "validate": "phone_or_email"},
+    ])
+    skipped = fill(form, ["Иван", "нет", "a@b.ru"])
+    assert skipped.answers == ["Иван", "Нет", None, "a@b.ru"]
+    assert skipped.step == END
+
+    full = fill(form, ["Иван", "Да", "Ленина, 1", "a@b.ru"])
+    assert full.answers == ["Иван", "Да", "Ленина, 1", "a@b.ru"]
+
+
+def test_branch_to_end_and_default_branch():
+    form = compile_form([
+        {"text": "Нужна консультация?", "options": ["Да", "Нет"], "next": {"Нет": "end", "*": "phone"}},
+        {"text": "Комментарий?"},
+        {"id": "phone", "text": "Телефон?", "validate": "phone"},
+    ])
+    assert fill(form, ["Нет"]).answers == ["Нет"]
+    assert fill(form, ["Да", "+79991234567"]).answers == ["Да", None, "+79991234567"]
+
+
+def test_plain_next_jumps_to_step():
+    form = compile_form([{"text": "A", "next": "end"}, {"text": "B"}])
+    assert form.steps[0].next == END
+
+
+def test_options_match_case_insensitively_and_reject_others():
+    step = compile_form([{"text": "Да или нет?", "options": ["Да", "Нет"]}]).steps[0]
+    assert step.validate("  да ") == "Да"
+    assert step.validate("может быть") is None
+    assert step.keyboard is not None
+    assert step.error == "Выберите один из вариантов на клавиатуре"
+
+
+@pytest.mark.parametrize("kind, good, bad", [
+    ("phone", "+7 (999) 123-45-67", "12345"),
+    ("email", "name@example.com", "name@example"),
+    ("phone_or_email", "name@example.com", "завтра"),
+    ("number", "12,5", "двенадцать"),
+])
+def test_validators(kind, good, bad):
+    step = compile_form([{"text": "?", "validate": kind}]).steps[0]
+    assert step.validate(good) == good
+    assert step.validate(bad) is None
+
+
+def test_regex_validator_and_custom_error():
+    step = compile_form([{"text": "Артикул?", "validate": "regex", "pattern": r"[A-Z]{2}\d{4}",
+                          "error": "Формат: AB1234"}]).steps[0]
+    assert step.validate("AB1234") == "AB1234"
+    assert step.validate("ab1234") is None
+    assert step.error == "Формат: AB1234"
+
+
+def test_empty_and_too_long_answers_are_rejected():
+    step = compile_form(["Имя"]).steps[0]
+    assert step.validate("   ") is None
+    assert step.validate("x" * 1001) is None
+
+
+@pytest.mark.parametrize("raw, message", [
+    ("{не json", "Неверный JSON"),
+    ('{"text": "A"}', "JSON-массивом"),
+    ([1], "Шаг 1"),
+    ([{"id": "a", "text": "A"}, {"id": "a", "text": "B"}], "повторяются id"),
+    ([{"text": "A", "next": "nowhere"}], "нет шага"),
+    ([{"text": "A", "validate": "passport"}], "неизвестная проверка"),
+    ([{"text": "A", "validate": "regex", "pattern": "("}], "регулярное выражение"),
+    ([{"text": "A", "options": 5}], "списком строк"),
+    ([{"text": "A", "options": "Да"}], "списком строк"),
+    ([{"text": "A", "options": ["Да", 1]}], "списком строк"),
+    ([{"text": "A", "validate": ["phone"]}], "validate должно быть строкой"),
+    ([{"text": "A", "validate": "regex", "pattern": 5}], "pattern должно быть строкой"),
+    ([{"text": "A", "error": {"ru": "нет"}}], "error должно быть строкой"),
+])
+def test_invalid_definitions_raise_form_error(raw, message):
+    with pytest.raises(FormError, match=message):
+        compile_form(raw)
+
+
+def test_question_texts_is_empty_for_broken_definition():
+    assert question_texts('["A", "B"]') == ["A", "B"]
+    assert question_texts("{не json") == []
+
+
+def test_progress_round_trips_through_state():
+    progress = FormProgress(form_id=7, step=2, answers=["a", None])
+    assert FormProgress.from_state(progress.to_state()) == progress
+    assert FormProgress.from_state({}) is None
+
+
+def test_progress_from_legacy_state():
+    progress = FormProgress.from_state({"form_button_id": 3, "answers": ["a", "b"]})
+    assert progress == FormProgress(form_id=3, step=2, answers=["a", "b"])
+
+
+@pytest.mark.parametrize("raw, expected", [
+    (json.dumps(["a", None]), ["a", None]),
+    ('"один"', ["один"]),
+    ("не json", ["не json"]),
+])
+def test_decode_answers(raw, expected):
+    assert decode_answers(raw) == expected
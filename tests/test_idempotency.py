@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import idempotency
+from idempotency import RecentSet, submission_key, submission_keys
+
+WINDOW = 600
+EDGE = datetime.fromtimestamp(1_800_000_000 // WINDOW * WINDOW)
+
+
+def keys(answers=("Иван", "+79991234567"), at=EDGE, window=WINDOW, user_id=2):
+    return submission_keys(1, user_id, 3, list(answers), at, window)
+
+
+def test_key_is_stable_and_depends_on_every_field():
+    key = submission_key(1, 2, 3, ["a", None], 5)
+    assert key == submission_key(1, 2, 3, ("a", None), 5)
+    assert len({
+        key,
+        submission_key(9, 2, 3, ["a", None], 5),
+        submission_key(1, 9, 3, ["a", None], 5),
+        submission_key(1, 2, 9, ["a", None], 5),
+        submission_key(1, 2, 3, ["b", None], 5),
+        submission_key(1, 2, 3, ["a", None], 6),
+    }) == 6
+
+
+def test_same_interval_gives_same_keys():
+    assert keys(at=EDGE + timedelta(seconds=1)) == keys(at=EDGE + timedelta(seconds=WINDOW - 1))
+
+
+def test_repeat_across_interval_edge_is_found_by_previous_key():
+    before = keys(at=EDGE - timedelta(seconds=1))
+    after = keys(at=EDGE + timedelta(seconds=1))
+    assert before[0] != after[0]
+    assert after[1] == before[0]
+
+
+def test_different_answers_or_user_never_collide():
+    assert not set(keys()) & set(keys(answers=("Пётр", "+79991234567")))
+    assert not set(keys()) & set(keys(user_id=5))
+
+
+def test_zero_window_keys_by_exact_time():
+    assert keys(window=0) != keys(at=EDGE + timedelta(seconds=1), window=0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(idempotency.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_recent_set_rejects_repeat(clock):
+    recent = RecentSet(10)
+    assert recent.add("a")
+    assert not recent.add("a")
+    assert recent.add("b")
+    assert len(recent) == 2
+
+
+def test_recent_set_forgets_after_ttl(clock):
+    recent = RecentSet(10, ttl=60)
+    assert recent.add("a")
+    clock[0] += 59
+    assert not recent.add("a")
+    clock[0] += 61
+    assert recent.add("a")
+
+
+def test_recent_set_evicts_least_recently_seen(clock):
+    recent = RecentSet(2)
+    recent.add("a")
+    recent.add("b")
+    recent.add("a")  # повтор освежает "a"
+    recent.add("c")
+    assert len(recent) == 2
+    assert not recent.add("a")
+    assert recent.add("b")
+
+
+def test_recent_set_discard_allows_readd(clock):
+    recent = RecentSet(10)
+    recent.add("a")
+    recent.discard("a")
+    recent.discard("missing")
+    assert recent.add("a")
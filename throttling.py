@@ -0,0 +1,126 @@
+"""Ограничение частоты апдейтов от одного пользователя.
+
+У каждого пользователя своё ведро токенов на каждый класс действий (меню,
+/start, ответы анкеты, админка). Вёдра лежат в LRU ограниченного размера:
+давно молчавшие пользователи вытесняются и при возвращении начинают
+с полного ведра. Лишние апдейты отбрасываются до хендлеров и сессии БД;
+один раз за серию пользователь получает предупреждение.
+"""
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import CallbackQuery
+
+from config import config
+from metrics import registry
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+START = "start"
+MENU = "menu"
+FORM = "form"
+ADMIN = "admin"
+
+WARNING_TEXT = "⏳ Слишком много сообщений. Подождите немного и попробуйте снова."
+
+throttled_total = registry.counter("bot_throttled_total", "Отброшенные из-за частоты апдейты", ["class"])
+throttle_warnings = registry.counter("bot_throttle_warnings_total", "Отправленные предупреждения о частоте", ["class"])
+throttle_evictions = registry.counter("bot_throttle_evictions_total", "Вёдра, вытесненные из LRU")
+
+
+class _UserBucket(TokenBucket):
+    __slots__ = ("warned",)
+
+    def __init__(self, rate: float, capacity: float):
+        super().__init__(rate, capacity)
+        self.warned = False
+
+
+def classify(event, data) -> str:
+    """Класс действия для апдейта: от него зависит лимит"""
+    user = data["event_from_user"]
+    if user.id in data["tenant"].admin_ids:
+        return ADMIN
+    if isinstance(event, CallbackQuery):
+        return ADMIN if (event.data or "").startswith("admin:") else MENU
+    if (event.text or "").startswith("/start"):
+        return START
+    # Состояние у обычного пользователя бывает только одно — заполнение анкеты
+    if data.get("raw_state"):
+        return FORM
+    return MENU
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Внешний middleware для message и callback_query"""
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], cache_size: int = 100000, warn: bool = True):
+        # limits: класс -> (токенов в секунду, размер ведра); нулевая скорость — без ограничения
+        self.limits = {name: limit for name, limit in limits.items() if limit[0] > 0}
+        self.cache_size = cache_size
+        self.warn = warn
+        self._buckets: "OrderedDict[Tuple[int, int, str], _UserBucket]" = OrderedDict()
+
+    def _bucket(self, key: Tuple[int, int, str], limit: Tuple[float, float]) -> _UserBucket:
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            self._buckets.move_to_end(key)
+            return bucket
+        bucket = self._buckets[key] = _UserBucket(*limit)
+        if len(self._buckets) > self.cache_size:
+            self._buckets.popitem(last=False)
+            throttle_evictions.inc()
+        return bucket
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        kind = classify(event, data)
+        limit = self.limits.get(kind)
+        if limit is None:
+            return await handler(event, data)
+
+        # У каждого магазина свой бот — и свои лимиты для того же пользователя
+        bucket = self._bucket((data["tenant"].id, user.id, kind), limit)
+        if bucket.try_acquire():
+            bucket.warned = False
+            return await handler(event, data)
+
+        throttled_total.inc(kind)
+        if self.warn and not bucket.warned:
+            bucket.warned = True
+            throttle_warnings.inc(kind)
+            await self._send_warning(event)
+        return None
+
+    @staticmethod
+    async def _send_warning(event):
+        # У Message это ответ в чат, у CallbackQuery — всплывающая подсказка
+        try:
+            await event.answer(WARNING_TEXT)
+        except TelegramAPIError as e:
+            logger.debug(f"Не удалось предупредить о частоте: {e}")
+
+
+def _per_minute(count: int, burst: int) -> Tuple[float, float]:
+    return count / 60, max(1, burst)
+
+
+def create_throttling() -> Optional[ThrottlingMiddleware]:
+    """Middleware по настройкам из config; None, если все лимиты выключены"""
+    middleware = ThrottlingMiddleware(
+        limits={
+            START: _per_minute(config.THROTTLE_START_PER_MINUTE, config.THROTTLE_BURST),
+            MENU: _per_minute(config.THROTTLE_MENU_PER_MINUTE, config.THROTTLE_BURST),
+            FORM: _per_minute(config.THROTTLE_FORM_PER_MINUTE, config.THROTTLE_BURST),
+            ADMIN: _per_minute(config.THROTTLE_ADMIN_PER_MINUTE, config.THROTTLE_BURST),
+        },
+        cache_size=config.THROTTLE_CACHE_SIZE,
+        warn=config.THROTTLE_WARN,
+    )
+    return middleware if middleware.limits else None
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+from aiogram.types import User as TelegramUser
+from sqlalchemy import false, func, select
+
+from config import config
+from database import get_db, upsert
+from models import User
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+
+
+class UserCollector:
+    """Запоминает пользователей, писавших боту, и периодически записывает их
+    одним upsert: хендлеры не ждут БД, а повторные нажатия в пределах
+    интервала схлопываются в одну строку"""
+
+    def __init__(self, flush_interval: float = 5):
+        self.flush_interval = flush_interval
+        self._pending: Dict[int, dict] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, user: TelegramUser):
+        self._pending[user.id] = {
+            "id": user.id,
+            "username": user.username,
+            "first_name": user.first_name,
+            "seen": datetime.now(),
+        }
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="users-flush")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи пользователей: {e}")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        rows = [
+            {"id": item["id"], "username": item["username"], "first_name": item["first_name"],
+             "first_seen": item["seen"], "last_seen": item["seen"], "is_blocked": False}
+            for item in pending.values()
+        ]
+        try:
+            async with get_db() as session:
+                for i in range(0, len(rows), CHUNK_SIZE):
+                    stmt = upsert(User.__table__)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=["id"],
+                        set_={
+                            "username": stmt.excluded.username,
+                            "first_name": stmt.excluded.first_name,
+                            "last_seen": stmt.excluded.last_seen,
+                            # Написал боту — значит, снова его не блокирует
+                            "is_blocked": false(),
+                        },
+                    )
+                    await session.execute(stmt, rows[i:i + CHUNK_SIZE])
+        except Exception:
+            # Не теряем пользователей: вернём их в очередь, если новых записей о них нет
+            for user_id, item in pending.items():
+                self._pending.setdefault(user_id, item)
+            raise
+
+
+async def count_reachable(session) -> int:
+    """Сколько пользователей получат рассылку"""
+    return await session.scalar(select(func.count()).select_from(User).where(User.is_blocked == false()))
+
+
+user_collector = UserCollector(flush_interval=config.USERS_FLUSH_SECONDS)
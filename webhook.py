@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import secrets
+from typing import Any, Dict, List
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from catalog import catalog_versions
+from config import config
+from metrics import metrics_handler
+from tenants import TenantEntry, tenant_registry
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Обрабатывает апдейты в фоне, но не больше max_tasks одновременно.
+
+    Когда все слоты заняты, ответ Telegram задерживается до освобождения слота,
+    и Telegram сам придерживает следующие апдейты.
+    """
+
+    def __init__(self, *args: Any, max_tasks: int = 100, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.max_tasks = max_tasks
+        self._slots = asyncio.Semaphore(max_tasks)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        await self._slots.acquire()
+        task = asyncio.create_task(self._background_feed_update(bot=bot, update=update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._release_slot)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    def _release_slot(self, task: asyncio.Task):
+        self._background_feed_update_tasks.discard(task)
+        self._slots.release()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def drain(self) -> None:
+        # Апдейты уже подтверждены Telegram — дорабатываем их перед остановкой
+        if self._background_feed_update_tasks:
+            logger.info(f"Ожидание {self.in_flight} апдейтов перед остановкой")
+            await asyncio.gather(*self._background_feed_update_tasks, return_exceptions=True)
+
+    async def close(self) -> None:
+        await self.drain()
+        await super().close()
+
+    async def health(self, request: web.Request) -> web.Response:
+        versions = catalog_versions()
+        if not versions:
+            return web.json_response({"status": "starting"}, status=503)
+        return web.json_response({
+            "status": "ok",
+            "in_flight": self.in_flight,
+            "max_tasks": self.max_tasks,
+            "catalogs": len(versions),
+            "catalog_version": max(versions.values()),
+        })
+
+
+class TenantRequestHandler(BoundedRequestHandler):
+    """Вебхуки всех магазинов на одном сервере: <WEBHOOK_PATH>/<id магазина>.
+
+    У каждого магазина свой секрет (см. tenant_secret), поэтому по чужому
+    адресу поддельный апдейт не пройдёт.
+    """
+
+    def __init__(self, *args: Any, bots: Dict[int, Bot], **kwargs: Any):
+        super().__init__(*args, bot=None, **kwargs)
+        self.bots = bots
+
+    async def resolve_bot(self, request: web.Request) -> Bot:
+        tenant_id = request.match_info["tenant_id"]
+        bot = self.bots.get(int(tenant_id)) if tenant_id.isdigit() else None
+        if bot is None:
+            raise web.HTTPNotFound()
+        return bot
+
+    def verify_secret(self, telegram_secret_token: str, bot: Bot) -> bool:
+        tenant = tenant_registry.for_bot(bot.id)
+        return tenant is not None and secrets.compare_digest(telegram_secret_token, tenant_secret(tenant))
+
+    async def close(self) -> None:
+        await self.drain()
+        # Боты делят одну HTTP-сессию
+        sessions = {id(bot.session): bot.session for bot in self.bots.values()}
+        await asyncio.gather(*(session.close() for session in sessions.values()))
+
+
+def _token_secret(token: str) -> str:
+    """Секрет, выведенный из токена бота: без токена его не подобрать"""
+    key = (config.WEBHOOK_SECRET or "webhook").encode()
+    return hmac.new(key, token.encode(), hashlib.sha256).hexdigest()
+
+
+def tenant_secret(tenant: TenantEntry) -> str:
+    """Секрет вебхука магазина"""
+    return _token_secret(tenant.token)
+
+
+def bot_secret(bot: Bot) -> str:
+    """Секрет вебхука в режиме одного бота: WEBHOOK_SECRET, а если он не задан —
+    выведенный из токена. Без секрета вебхук принял бы поддельный апдейт от кого угодно"""
+    return config.WEBHOOK_SECRET or _token_secret(bot.token)
+
+
+async def register_webhook(bot: Bot, dp: Dispatcher, path: str, secret_token: str):
+    """Указывает Telegram адрес вебхука. Накопленные апдейты не сбрасываются"""
+    url = config.WEBHOOK_URL.rstrip("/") + path
+    await bot.set_webhook(
+        url=url,
+        secret_token=secret_token,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+        drop_pending_updates=False,
+    )
+    logger.info(f"Вебхук установлен: {url}")
+
+
+async def run_webhook(dp: Dispatcher, bots: List[Bot]):
+    """Поднимает aiohttp-сервер и обслуживает апдейты, пока задачу не отменят"""
+    app = web.Application()
+    if config.MULTI_TENANT:
+        handler = TenantRequestHandler(
+            dispatcher=dp,
+            bots={tenant_registry.for_bot(bot.id).id: bot for bot in bots},
+            max_tasks=config.WEBHOOK_MAX_TASKS,
+        )
+        handler.register(app, path=config.WEBHOOK_PATH + "/{tenant_id}")
+    else:
+        handler = BoundedRequestHandler(
+            dispatcher=dp,
+            bot=bots[0],
+            secret_token=bot_secret(bots[0]),
+            max_tasks=config.WEBHOOK_MAX_TASKS,
+        )
+        handler.register(app, path=config.WEBHOOK_PATH)
+    app.router.add_get("/healthz", handler.health)
+    app.router.add_get("/metrics", metrics_handler)
+    setup_application(app, dp, bot=bots[-1], bots=bots)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBAPP_HOST, config.WEBAPP_PORT, reuse_port=config.WEBAPP_REUSE_PORT or None)
+    await site.start()
+    logger.info(f"Вебхук-сервер слушает {config.WEBAPP_HOST}:{config.WEBAPP_PORT}{config.WEBHOOK_PATH} "
+                f"(ботов: {len(bots)})")
+    try:
+        # При нескольких воркерах вебхук регистрирует только основной
+        if config.RUN_BACKGROUND_JOBS and config.MULTI_TENANT:
+            tenants = [tenant_registry.for_bot(bot.id) for bot in bots]
+            await asyncio.gather(*(
+                register_webhook(bot, dp, f"{config.WEBHOOK_PATH}/{tenant.id}", tenant_secret(tenant))
+                for bot, tenant in zip(bots, tenants)
+            ))
+        elif config.RUN_BACKGROUND_JOBS:
+            await register_webhook(bots[0], dp, config.WEBHOOK_PATH, bot_secret(bots[0]))
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()